@@ -0,0 +1,266 @@
+"""Offline load test: replays synthetic users through the bot's full handler stack.
+
+The real Application from main.build_application() runs against a throwaway
+SQLite database and a fake Bot API that answers every request locally, so no
+network or token is needed. Each simulated user walks the grade conversation
+(/start, specialization, level, sub-level, then every subject's grades) for a
+level of the curriculum, sending its next message once the previous update
+has been handled, like a real client waiting for the bot's reply.
+
+    python benchmarks/load_test.py --users 5000 --active 300 --api-latency 50
+
+Reports updates/sec, p50/p95/p99 update latency, time spent in Database
+methods and Bot API calls per completed calculation. --json prints the same
+figures as JSON for comparing runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+FIRST_USER_ID = 10_000_000
+
+
+def user_scripts() -> List[Tuple[str, List[str]]]:
+    """One message script per reachable level: (level, messages after /start)"""
+    from curriculum import CURRICULUM, LEVELS_WITH_SUB_LEVELS
+    from grade_calculator import NOT_ADDED_LEVELS, NOT_SUPPORTED_LEVELS
+
+    scripts = []
+    for (specialization, level), subjects in CURRICULUM.items():
+        messages = [specialization.capitalize()]
+        if " (+" in level:
+            base, sub_level = level.split(" (")
+            if base not in LEVELS_WITH_SUB_LEVELS:
+                continue
+            messages += [base.capitalize(), sub_level.rstrip(")")]
+        else:
+            messages.append(level.capitalize())
+        if level not in NOT_ADDED_LEVELS and level not in NOT_SUPPORTED_LEVELS:
+            # A None placeholder per grade; filled with random grades per user
+            messages += [None] * sum(record.exam_count for record in subjects)
+        scripts.append((level, messages))
+    return scripts
+
+
+class FakeBotApi:
+    """Stand-in for the Telegram Bot API answering every method locally"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+
+    def respond(self, method: str, params: Dict) -> object:
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "u"}}
+        if method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            return {"message_id": self._message_id, "date": int(time.time()),
+                    "chat": {"id": int(params["chat_id"]), "type": "private"}, "text": params.get("text", "")}
+        return True
+
+
+def make_request(api: FakeBotApi):
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            if api.latency:
+                await asyncio.sleep(api.latency)
+            params = request_data.parameters if request_data else {}
+            result = api.respond(url.rsplit("/", 1)[-1], params)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeRequest()
+
+
+class DatabaseTimer:
+    """Wraps every public Database method to accumulate its wall time"""
+
+    def __init__(self, db):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        for name in dir(db):
+            method = getattr(db, name)
+            if not name.startswith("_") and callable(method) and name != "close":
+                setattr(db, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.seconds[name] += elapsed
+                    self.calls[name] += 1
+        return timed
+
+
+def percentile(values: List[float], q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def run(args) -> Dict:
+    import main
+    from grade_stats import ALL_LEVELS
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    api = FakeBotApi(args.api_latency / 1000)
+    application = main.build_application(main.database, request=make_request(api))
+    db_timer = DatabaseTimer(main.database.sync)
+
+    pending: Dict[int, Tuple[float, asyncio.Event]] = {}
+    latencies: List[float] = []
+
+    async def record_done(update: Update, context):
+        enqueued_at, done = pending.pop(update.update_id)
+        latencies.append(time.perf_counter() - enqueued_at)
+        done.set()
+
+    # Runs after every other group, i.e. once the bot has replied
+    application.add_handler(TypeHandler(Update, record_done), group=100)
+
+    rng = random.Random(args.seed)
+    scripts = user_scripts()
+    update_ids = iter(range(1, 10 ** 9))
+    active = asyncio.Semaphore(args.active)
+
+    async def send(user_id: int, text: str):
+        update_id = next(update_ids)
+        done = asyncio.Event()
+        pending[update_id] = (time.perf_counter(), done)
+        await application.update_queue.put(Update.de_json(message_update(update_id, user_id, text), application.bot))
+        await done.wait()
+
+    async def simulate(user_id: int, messages: List[Optional[str]]):
+        async with active:
+            await send(user_id, "/start")
+            for text in messages:
+                await send(user_id, text if text is not None else f"{rng.uniform(4, 18):.2f}")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    calls_before_run = sum(api.calls.values())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            simulate(FIRST_USER_ID + number, rng.choice(scripts)[1]) for number in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    calculations = sum(stats.count for (_, level), stats in main.database.stats.items() if level != ALL_LEVELS)
+    api_calls = sum(api.calls.values()) - calls_before_run
+    return {
+        "users": args.users,
+        "active_users": args.active,
+        "api_latency_ms": args.api_latency,
+        "updates": len(latencies),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            f"p{q}": round(percentile(latencies, q) * 1000, 2) for q in (50, 95, 99)
+        },
+        "calculations": calculations,
+        "api_calls": dict(api.calls),
+        "api_calls_per_calculation": round(api_calls / calculations, 2) if calculations else None,
+        "db_seconds": round(sum(db_timer.seconds.values()), 3),
+        "db_methods": {
+            name: {"calls": db_timer.calls[name], "seconds": round(seconds, 4)}
+            for name, seconds in sorted(db_timer.seconds.items(), key=lambda item: -item[1])
+        },
+    }
+
+
+def print_report(report: Dict):
+    print(f"{report['updates']} updates from {report['users']} users ({report['active_users']} active at once, "
+          f"{report['api_latency_ms']} ms simulated API latency) in {report['seconds']}s")
+    print(f"  throughput: {report['updates_per_second']} updates/s")
+    latency = report["latency_ms"]
+    print(f"  latency:    p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    print(f"  calculations completed: {report['calculations']}, "
+          f"Bot API calls per calculation: {report['api_calls_per_calculation']}")
+    print(f"  Bot API calls: {report['api_calls']}")
+    print(f"  database time: {report['db_seconds']}s")
+    for name, method in report["db_methods"].items():
+        print(f"    {name:<32} {method['calls']:>7} calls {method['seconds']:>9.4f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="number of simulated users")
+    parser.add_argument("--active", type=int, default=200, help="users talking to the bot at the same time")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API round trip in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # main creates its database from DB_PATH on import; migrate it first
+        # like a deployment would
+        import logging
+        import sqlite3
+        import migrations
+        os.environ["DB_PATH"] = db_path = os.path.join(directory, "load_test.db")
+        os.environ.setdefault("BOT_TOKEN", "123456:load-test")
+        conn = sqlite3.connect(db_path)
+        migrations.migrate(conn)
+        conn.close()
+        import main as bot_main  # noqa: F401  (configures logging on import)
+        logging.getLogger().setLevel(logging.WARNING)
+        report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+
+from database import AsyncDatabase
+from logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second to different chats
+DEFAULT_RATE = 25
+DEFAULT_CONCURRENCY = 10
+DEFAULT_PAGE_SIZE = 500
+REMOVAL_BATCH_SIZE = 100
+DELIVERY_BATCH_SIZE = 100
+MAX_ATTEMPTS = 3
+# A job whose lease is not renewed for this long is resumed by another process
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Messages processed per second"""
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.processed} processed ({self.sent} sent, {self.blocked} blocked, "
+                f"{self.failed} failed) in {self.elapsed:.1f}s, {self.rate:.1f} msg/s")
+
+
+class RateLimiter:
+    """Spaces calls out to at most ``rate`` per second across all tasks"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot = max(self._next_slot, loop.time()) + self.interval
+
+    def pause(self, seconds: float):
+        """Hold every sender back, used when Telegram answers with RetryAfter"""
+        loop = asyncio.get_running_loop()
+        self._next_slot = max(self._next_slot, loop.time() + seconds)
+
+
+ProgressCallback = Callable[[BroadcastStats], Awaitable[None]]
+
+
+class Broadcaster:
+    """Sends one message to every known user under Telegram's rate limits.
+
+    Every broadcast is a job stored in the database. User IDs are read page by
+    page in user_id order, each page is sent with at most ``concurrency``
+    requests in flight and at most ``rate`` messages per second overall.
+    Delivery results are recorded in batches and the job cursor is advanced
+    after each page, so an interrupted job resumes where it stopped and only
+    the last unrecorded batch can be sent twice. Users who blocked the bot are
+    removed in batches.
+
+    The process sending a job holds a lease on it and renews it every
+    HEARTBEAT_SECONDS. Only jobs whose lease expired are resumed, so a job is
+    never sent by two live instances; a sender that loses its lease stops.
+    """
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, rate: float = DEFAULT_RATE,
+                 concurrency: int = DEFAULT_CONCURRENCY, page_size: int = DEFAULT_PAGE_SIZE,
+                 progress_every: int = 1000):
+        self.bot = bot
+        self.db = db
+        self.page_size = page_size
+        self.progress_every = progress_every
+        self._limiter = RateLimiter(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._blocked: List[int] = []
+        self._deliveries: List[Tuple[int, str]] = []
+        self._delivery_lock = asyncio.Lock()
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def run(self, text: str, parse_mode: Optional[str] = None,
+                  progress: Optional[ProgressCallback] = None) -> BroadcastStats:
+        """Start a new broadcast job and run it to completion"""
+        job_id = await self.db.create_broadcast_job(text, parse_mode, self.owner, LEASE_SECONDS)
+        job = {'id': job_id, 'message': text, 'parse_mode': parse_mode,
+               'cursor': 0, 'sent': 0, 'blocked': 0, 'failed': 0}
+        return await self._run_job(job, progress)
+
+    async def resume(self, progress: Optional[ProgressCallback] = None) -> List[BroadcastStats]:
+        """Finish every job that was interrupted, e.g. by an instance restart"""
+        results = []
+        for job in await self.db.get_unfinished_broadcast_jobs():
+            if not await self.db.claim_broadcast_job(job['id'], self.owner, LEASE_SECONDS):
+                logger.info(f"Broadcast job {job['id']} was claimed by another process")
+                continue
+            logger.info(f"Resuming broadcast job {job['id']} after user {job['cursor']}")
+            results.append(await self._run_job(job, progress))
+        return results
+
+    async def _run_job(self, job: Dict, progress: Optional[ProgressCallback]) -> BroadcastStats:
+        job_id = job['id']
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._keep_lease(job_id, lease_lost))
+        try:
+            return await self._send_job(job, progress, lease_lost)
+        finally:
+            heartbeat.cancel()
+
+    async def _send_job(self, job: Dict, progress: Optional[ProgressCallback],
+                        lease_lost: asyncio.Event) -> BroadcastStats:
+        job_id = job['id']
+        text, parse_mode = job['message'], job['parse_mode']
+        stats = BroadcastStats(sent=job['sent'], blocked=job['blocked'], failed=job['failed'])
+        next_report = stats.processed + self.progress_every
+        after_user_id = job['cursor']
+        # Users of the interrupted page that were handled before the restart
+        already_done = await self.db.get_broadcast_deliveries_after(job_id, after_user_id)
+
+        async for user_ids in self.db.iter_user_id_pages(after_user_id, self.page_size):
+            await asyncio.gather(*(
+                self._send(job_id, user_id, text, parse_mode, stats)
+                for user_id in user_ids if user_id not in already_done
+            ))
+            after_user_id = user_ids[-1]
+            already_done.difference_update(user_ids)
+
+            if len(self._blocked) >= REMOVAL_BATCH_SIZE:
+                await self._remove_blocked()
+            if not await self._flush_deliveries(job_id, stats, cursor_position=after_user_id):
+                lease_lost.set()
+            if lease_lost.is_set():
+                await self._remove_blocked()
+                logger.warning(f"Broadcast {job_id} lost its lease to another process, stopping: {stats}")
+                return stats
+            if stats.processed >= next_report:
+                next_report = stats.processed + self.progress_every
+                logger.info(f"Broadcast {job_id} progress: {stats}")
+                if progress is not None:
+                    await progress(stats)
+
+        await self._remove_blocked()
+        await self._flush_deliveries(job_id, stats, status='done')
+        logger.info(f"Broadcast {job_id} finished: {stats}")
+        return stats
+
+    async def _keep_lease(self, job_id: int, lease_lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            if not await self.db.renew_broadcast_lease(job_id, self.owner, LEASE_SECONDS):
+                lease_lost.set()
+                return
+
+    async def _send(self, job_id: int, user_id: int, text: str, parse_mode: Optional[str],
+                    stats: BroadcastStats):
+        async with self._semaphore:
+            status = await self._deliver(user_id, text, parse_mode)
+        setattr(stats, status, getattr(stats, status) + 1)
+        self._deliveries.append((user_id, status))
+        if len(self._deliveries) >= DELIVERY_BATCH_SIZE:
+            await self._flush_deliveries(job_id, stats)
+
+    async def _deliver(self, user_id: int, text: str, parse_mode: Optional[str]) -> str:
+        """Send to one user, returning the BroadcastStats field to count it under"""
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._limiter.wait()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text, parse_mode=parse_mode)
+                return 'sent'
+            except RetryAfter as e:
+                logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+                self._limiter.pause(float(e.retry_after))
+            except Forbidden:
+                logger.warning(f"User {user_id} has blocked the bot. Removing from the database.", extra=SAMPLED)
+                self._blocked.append(user_id)
+                return 'blocked'
+            except Exception as e:
+                logger.error(f"Failed to send message to user {user_id}: {e}", extra=SAMPLED)
+                break
+        return 'failed'
+
+    async def _flush_deliveries(self, job_id: int, stats: BroadcastStats,
+                                cursor_position: Optional[int] = None, status: Optional[str] = None) -> bool:
+        """Record the pending deliveries; False if this process no longer holds the job"""
+        async with self._delivery_lock:
+            deliveries, self._deliveries = self._deliveries, []
+            return await self.db.record_broadcast_progress(
+                job_id, deliveries, stats.sent, stats.blocked, stats.failed, cursor_position, status, self.owner
+            )
+
+    async def _remove_blocked(self):
+        blocked, self._blocked = self._blocked, []
+        if blocked:
+            await self.db.remove_users_from_database(blocked)
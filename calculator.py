@@ -0,0 +1,111 @@
+"""Pure grade arithmetic shared by the Telegram handlers, free of any I/O"""
+import math
+from typing import List, Sequence, Tuple
+
+from curriculum import Subject
+
+# Overall average needed to pass a level
+PASSING_AVERAGE = 10.0
+
+
+def round_average(value: float) -> float:
+    """Round up to two decimals, the way results are shown to students"""
+    return math.ceil(value * 100) / 100
+
+
+def subject_average(record: Subject, exams: Sequence[float]) -> float:
+    """Average of one subject: the mean of its exam grade(s).
+
+    ``exams`` holds the exam grade(s), or the subject average itself for
+    subjects entered directly. batch_subject_averages computes the same value.
+    """
+    if len(exams) != record.exam_count:
+        raise ValueError(f"{record.name} needs {record.exam_count} exam grade(s), got {len(exams)}")
+    return sum(exams) / record.exam_count
+
+
+def overall_average(subjects: Sequence[Subject], averages: Sequence[float]) -> float:
+    """Coefficient-weighted average of a level's subject averages"""
+    if len(averages) != len(subjects):
+        raise ValueError(f"Expected {len(subjects)} subject averages, got {len(averages)}")
+    total_coefficients = sum(record.coefficient for record in subjects)
+    if not total_coefficients:
+        raise ValueError("No subjects found for this level")
+    return sum(average * record.coefficient for average, record in zip(averages, subjects)) / total_coefficients
+
+
+def required_average(subjects: Sequence[Subject], known_averages: Sequence[float],
+                     target: float = PASSING_AVERAGE) -> float:
+    """Minimum average needed on every remaining subject to reach ``target``.
+
+    ``known_averages`` are the averages of the first subjects of the level.
+    A result <= 0 means the target is already secured, > 20 that it is out of
+    reach.
+    """
+    if len(known_averages) >= len(subjects):
+        raise ValueError("No subjects left to grade")
+    known, remaining = subjects[:len(known_averages)], subjects[len(known_averages):]
+    total_coefficients = sum(record.coefficient for record in subjects)
+    secured = sum(average * record.coefficient for average, record in zip(known_averages, known))
+    return (target * total_coefficients - secured) / sum(record.coefficient for record in remaining)
+
+
+def rattrapage_requirements(subjects: Sequence[Subject], averages: Sequence[float],
+                            target: float = PASSING_AVERAGE) -> List[Tuple[Subject, float]]:
+    """For each subject below ``target``, the grade needed when retaking only that one.
+
+    Subjects where even a 20 would not be enough are left out.
+    """
+    total_coefficients = sum(record.coefficient for record in subjects)
+    total = overall_average(subjects, averages) * total_coefficients
+    requirements = []
+    for record, average in zip(subjects, averages):
+        if average >= target:
+            continue
+        needed = (target * total_coefficients - (total - average * record.coefficient)) / record.coefficient
+        if needed <= 20:
+            requirements.append((record, needed))
+    return sorted(requirements, key=lambda item: item[1])
+
+
+def _numpy():
+    # Imported on first use: only the batch helpers need numpy, and importing
+    # it would add noticeably to the bot's cold start
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The batch grade helpers require numpy (pip install numpy)") from None
+    return numpy
+
+
+def batch_subject_averages(subjects: Sequence[Subject], first, second=None):
+    """Vectorized subject averages for many students at once.
+
+    ``first`` and ``second`` are (students x subjects) arrays of exam grades;
+    ``second`` is ignored for subjects with a single exam or a direct average.
+    """
+    np = _numpy()
+    first = np.asarray(first, dtype=float)
+    if second is None:
+        return first
+    second = np.asarray(second, dtype=float)
+    two_exams = np.array([record.exam_count == 2 for record in subjects])
+    return np.where(two_exams, (first + second) / 2, first)
+
+
+def batch_overall_averages(subjects: Sequence[Subject], averages):
+    """Overall averages of many grade sheets: (students x subjects) -> (students,)"""
+    np = _numpy()
+    averages = np.asarray(averages, dtype=float)
+    coefficients = np.array([record.coefficient for record in subjects], dtype=float)
+    if averages.shape[-1] != coefficients.size:
+        raise ValueError(f"Expected {coefficients.size} subject averages per sheet, got {averages.shape[-1]}")
+    if not coefficients.sum():
+        raise ValueError("No subjects found for this level")
+    return averages @ coefficients / coefficients.sum()
+
+
+def batch_round_averages(values):
+    """Vectorized round_average"""
+    np = _numpy()
+    return np.ceil(np.asarray(values, dtype=float) * 100) / 100
@@ -0,0 +1,89 @@
+"""Read-only subject index compiled once from the tables in specializations.py"""
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Tuple
+
+from specializations import (
+    specializations,
+    exam1_subjects,
+    exam2_subjects,
+    td_subjects,
+    tp_subjects,
+    subject_with_cc,
+    special_subjects,
+    levelsWithSubLevels,
+)
+
+# Component flags
+EXAM1 = 1 << 0
+EXAM2 = 1 << 1
+TD = 1 << 2
+TP = 1 << 3
+CC = 1 << 4
+SPECIAL = 1 << 5
+
+_FLAG_GROUPS = (
+    (EXAM1, frozenset(exam1_subjects)),
+    (EXAM2, frozenset(exam2_subjects)),
+    (TD, frozenset(td_subjects)),
+    (TP, frozenset(tp_subjects)),
+    (CC, frozenset(subject_with_cc)),
+    (SPECIAL, frozenset(special_subjects)),
+)
+
+
+class Subject(NamedTuple):
+    name: str
+    coefficient: float
+    flags: int
+
+    def has(self, flag: int) -> bool:
+        return bool(self.flags & flag)
+
+    @property
+    def two_exams(self) -> bool:
+        """Whether the subject average is the mean of two exam grades"""
+        return self.flags & (EXAM1 | EXAM2) == EXAM1 | EXAM2
+
+    @property
+    def direct_average(self) -> bool:
+        """Whether the student enters the subject average directly"""
+        return bool(self.flags & SPECIAL)
+
+    @property
+    def exam_count(self) -> int:
+        """Number of grades the student enters for the exam part"""
+        return 2 if self.two_exams and not self.direct_average else 1
+
+
+def subject_flags(name: str) -> int:
+    flags = 0
+    for flag, names in _FLAG_GROUPS:
+        if name in names:
+            flags |= flag
+    return flags
+
+
+def _compile() -> Mapping[Tuple[str, str], Tuple[Subject, ...]]:
+    index = {}
+    for specialization, levels in specializations.items():
+        for level, subjects in levels.items():
+            index[(specialization, level)] = tuple(
+                Subject(name, coefficient, subject_flags(name))
+                for name, coefficient in subjects.items()
+            )
+    return MappingProxyType(index)
+
+
+CURRICULUM = _compile()
+LEVELS_WITH_SUB_LEVELS = frozenset(levelsWithSubLevels)
+# Level names are unique across specializations: level -> specialization
+LEVEL_SPECIALIZATIONS = MappingProxyType({level: specialization for specialization, level in CURRICULUM})
+
+
+def get_subjects(specialization: str, level: str) -> Tuple[Subject, ...]:
+    """Return the ordered subjects of a level, or an empty tuple if unknown"""
+    return CURRICULUM.get((specialization, level), ())
+
+
+def has_level(specialization: str, level: str) -> bool:
+    return (specialization, level) in CURRICULUM
@@ -1,234 +1,313 @@
 import sqlite3
-from contextlib import closing
+from contextlib import contextmanager
 import threading
 import logging
-from typing import List, Optional, Dict
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Dict, Set, Tuple
+from collections import OrderedDict
 import time
-from functools import lru_cache
+from functools import partial
+from grade_stats import StatsEngine, StatsRow
+from write_behind import WriteBehindBuffer
+import metrics
+from logging_setup import SAMPLED
+import migrations
 
+# PRAGMAs applied to every pooled connection. WAL lets readers proceed while a
+# write is in progress, and NORMAL synchronous is durable enough under WAL.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+class ConnectionPool:
+    """Small fixed-size pool of long-lived SQLite connections"""
+
+    def __init__(self, db_path: str, size: int = 4):
+        self.db_path = db_path
+        self.size = size
+        self._pool: queue.Queue = queue.Queue(maxsize=size)
+        self._connections: List[sqlite3.Connection] = []
+        for _ in range(size):
+            conn = self._connect()
+            self._connections.append(conn)
+            self._pool.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, rolling back anything left uncommitted on return"""
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    def close(self):
+        """Close every connection owned by the pool"""
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+
+VISITORS_COUNTER = 'visitors'
+USAGE_COUNTER = 'usage'
+
+class CounterCache:
+    """In-memory aggregate counters, seeded from SQLite and kept current by writes.
+
+    A counter is loaded lazily on first read, adjusted in place on every write
+    and reloaded once it is older than ``ttl`` seconds or explicitly invalidated.
+    Loads run outside the lock; a load that overlapped a write may have missed
+    it, so it is retried instead of cached.
+    """
+
+    LOAD_ATTEMPTS = 3
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._values: Dict[str, int] = {}
+        self._loaded_at: Dict[str, float] = {}
+        # Bumped by every add/invalidate, to detect writes during a load
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def peek(self, name: str) -> Optional[int]:
+        """Return the cached value if it is still fresh, without loading"""
+        with self._lock:
+            loaded_at = self._loaded_at.get(name)
+            if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+                return None
+            return self._values[name]
+
+    def get(self, name: str, loader: Callable[[], int]) -> int:
+        value = self.peek(name)
+        if value is not None:
+            return value
+        for _ in range(self.LOAD_ATTEMPTS):
+            with self._lock:
+                generation = self._generation
+            value = loader()
+            with self._lock:
+                if self._generation == generation:
+                    self._values[name] = value
+                    self._loaded_at[name] = time.monotonic()
+                    return value
+        # Still racing with writes: answer without caching, the next read reloads
+        return value
+
+    def add(self, name: str, delta: int):
+        """Adjust a seeded counter; unseeded counters will pick it up on load"""
+        if not delta:
+            return
+        with self._lock:
+            self._generation += 1
+            if name in self._values:
+                self._values[name] += delta
+
+    def invalidate(self, name: Optional[str] = None):
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self._values.clear()
+                self._loaded_at.clear()
+            else:
+                self._values.pop(name, None)
+                self._loaded_at.pop(name, None)
+
+# (specialization, level) last chosen by a user
+Profile = Tuple[str, str]
+
+class ProfileCache:
+    """Bounded LRU of user profiles, including users known to have none"""
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._profiles: "OrderedDict[int, Optional[Profile]]" = OrderedDict()
+
+    def get(self, user_id: int):
+        """Return the cached profile (possibly None) or ProfileCache.MISSING"""
+        profile = self._profiles.get(user_id, self.MISSING)
+        if profile is not self.MISSING:
+            self._profiles.move_to_end(user_id)
+        return profile
+
+    def put(self, user_id: int, profile: Optional[Profile]):
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        if len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    def discard(self, user_id: int):
+        self._profiles.pop(user_id, None)
+
+@metrics.instrument_methods
 class Database:
-    def __init__(self, db_path: str):
-        # Configure logging first
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+    def __init__(self, db_path: str, pool_size: int = 4, counter_ttl: float = 300.0):
         self.logger = logging.getLogger('Database')
-        
-        # Then initialize other attributes
         self.db_path = db_path
-        self.lock = threading.Lock()
-        self._initialized = False
-        self._init_db()
-        self._create_indexes()
-
-    def _check_table_structure(self, cursor, table_name):
-        """Check if table has the required columns"""
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = {row[1] for row in cursor.fetchall()}
-        return columns
-
-    def _migrate_table(self, cursor, table_name, required_columns):
-        """Migrate table to new structure if needed"""
-        current_columns = self._check_table_structure(cursor, table_name)
-        
-        # If table doesn't exist or is missing columns, recreate it
-        if not current_columns or not all(col in current_columns for col in required_columns):
-            self.logger.info(f"Migrating table {table_name} to new structure")
-            
-            # Backup old data if table exists
-            if current_columns:
-                temp_table = f"temp_{table_name}"
-                cursor.execute(f"ALTER TABLE {table_name} RENAME TO {temp_table}")
-            
-            # Create new table structure
-            if table_name == 'visitors':
-                cursor.execute('''
-                    CREATE TABLE visitors (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE NOT NULL,
-                        visit_count INTEGER DEFAULT 1,
-                        last_visit TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-            elif table_name == 'overall_average':
-                cursor.execute('''
-                    CREATE TABLE overall_average (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        count INTEGER DEFAULT 0,
-                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-            elif table_name == 'user_stats':
-                cursor.execute('''
-                    CREATE TABLE user_stats (
-                        user_id INTEGER PRIMARY KEY,
-                        total_calculations INTEGER DEFAULT 0,
-                        last_calculation TIMESTAMP,
-                        average_grade REAL,
-                        FOREIGN KEY (user_id) REFERENCES visitors(user_id)
-                    )
-                ''')
-            
-            # Migrate data if old table existed
-            if current_columns:
-                common_columns = current_columns.intersection(required_columns)
-                if common_columns:
-                    columns_str = ', '.join(common_columns)
-                    cursor.execute(f"INSERT INTO {table_name} ({columns_str}) SELECT {columns_str} FROM {temp_table}")
-                cursor.execute(f"DROP TABLE {temp_table}")
-
-    def _init_db(self):
-        """Initialize database with proper schema and indexes"""
-        if self._initialized:
-            return
-            
-        with self.lock:
-            with closing(sqlite3.connect(self.db_path)) as conn:
-                cursor = conn.cursor()
-                
-                # Define required columns for each table
-                visitors_columns = {'id', 'user_id', 'visit_count', 'last_visit', 'created_at'}
-                overall_average_columns = {'id', 'count', 'last_updated'}
-                user_stats_columns = {'user_id', 'total_calculations', 'last_calculation', 'average_grade'}
-                
-                # Migrate tables if needed
-                self._migrate_table(cursor, 'visitors', visitors_columns)
-                self._migrate_table(cursor, 'overall_average', overall_average_columns)
-                self._migrate_table(cursor, 'user_stats', user_stats_columns)
-                
-                conn.commit()
-                self._initialized = True
-                self.logger.info("Database initialized successfully")
+        self.lock = metrics.timed_lock(threading.Lock(), 'database')
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.counters = CounterCache(counter_ttl)
+        self._ensure_schema()
 
-    def _create_indexes(self):
-        """Create necessary indexes for better query performance"""
-        if not self._initialized:
-            return
-            
-        with self.lock:
-            with closing(sqlite3.connect(self.db_path)) as conn:
-                cursor = conn.cursor()
-                
-                # Create indexes for visitors table
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_user_id ON visitors(user_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_last_visit ON visitors(last_visit)')
-                
-                # Create indexes for user_stats table
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_last_calculation ON user_stats(last_calculation)')
-                
-                conn.commit()
-                self.logger.info("Indexes created successfully")
+    def _ensure_schema(self):
+        """Apply pending migrations if the deploy step did not (e.g. local runs)"""
+        with self.lock, self.pool.connection() as conn:
+            version = migrations.get_version(conn)
+            if version < migrations.SCHEMA_VERSION:
+                self.logger.warning(
+                    f"Database schema is at version {version}, migrating to {migrations.SCHEMA_VERSION}. "
+                    "Run migrations.py before starting the bot to keep this off startup."
+                )
+                migrations.migrate(conn)
+
+    def _count_visitors(self) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM visitors')
+            return cursor.fetchone()[0]
+
+    def _count_usage(self) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Older versions inserted one row per calculation, so the total
+            # is spread over every row
+            cursor.execute('SELECT COALESCE(SUM(count), 0) FROM overall_average')
+            return cursor.fetchone()[0]
 
-    @lru_cache(maxsize=1000)
     def get_visitor_count(self) -> int:
-        """Get total visitor count with caching"""
+        """Get total visitor count from the counter cache"""
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT COUNT(DISTINCT user_id) FROM visitors')
-                    return cursor.fetchone()[0]
+            return self.counters.get(VISITORS_COUNTER, self._count_visitors)
         except sqlite3.Error as e:
             self.logger.error(f"Error getting visitor count: {str(e)}")
             return 0
 
     def update_visitors(self, user_id: int):
         """Update visitor count with proper error handling and logging"""
-        try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    
-                    # Check if user exists
-                    cursor.execute('SELECT id FROM visitors WHERE user_id = ?', (user_id,))
-                    exists = cursor.fetchone()
-                    
-                    if exists:
-                        # Update existing user
-                        cursor.execute('''
-                            UPDATE visitors 
-                            SET visit_count = visit_count + 1,
-                                last_visit = CURRENT_TIMESTAMP
-                            WHERE user_id = ?
-                        ''', (user_id,))
-                    else:
-                        # Insert new user
-                        cursor.execute('''
-                            INSERT INTO visitors (user_id, visit_count, last_visit)
-                            VALUES (?, 1, CURRENT_TIMESTAMP)
-                        ''', (user_id,))
-                    
-                    conn.commit()
-                    self.logger.info(f"Updated visitor count for user {user_id}")
-        except sqlite3.Error as e:
-            self.logger.error(f"Error updating visitor count: {str(e)}")
-            raise
+        self.record_counters({user_id: 1}, 0)
 
-    @lru_cache(maxsize=100)
     def get_overall_average_count(self) -> int:
-        """Get overall average count with caching"""
-        with self.lock:
-            with closing(sqlite3.connect(self.db_path)) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT count FROM overall_average ORDER BY id DESC LIMIT 1')
-                result = cursor.fetchone()
-                return result[0] if result else 0
+        """Get overall average count from the counter cache"""
+        return self.counters.get(USAGE_COUNTER, self._count_usage)
 
     def increment_overall_average_count(self):
         """Increment overall average count with proper error handling"""
+        self.record_counters({}, 1)
+
+    def record_counters(self, visits: Dict[int, int], usage: int, grade_stats: List[StatsRow] = ()):
+        """Apply a coalesced batch of visitor, usage and grade statistics updates in one transaction"""
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    
-                    # Use UPSERT for better performance
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                new_visitors = 0
+
+                if visits:
+                    rows = list(visits.items())
+                    cursor.executemany('''
+                        UPDATE visitors
+                        SET visit_count = visit_count + ?,
+                            last_visit = CURRENT_TIMESTAMP
+                        WHERE user_id = ?
+                    ''', [(count, user_id) for user_id, count in rows])
+                    # Rows that already exist are ignored here, so the row
+                    # count is exactly the number of first-time visitors
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO visitors (user_id, visit_count, last_visit)
+                        VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ''', rows)
+                    new_visitors = cursor.rowcount
+
+                if usage:
+                    # Add to the most recent row; the total is the sum of all rows
                     cursor.execute('''
-                        INSERT INTO overall_average (count, last_updated)
-                        VALUES (1, CURRENT_TIMESTAMP)
-                        ON CONFLICT(id) DO UPDATE SET
-                            count = count + 1,
+                        UPDATE overall_average
+                        SET count = count + ?,
                             last_updated = CURRENT_TIMESTAMP
-                    ''')
-                    
-                    conn.commit()
-                    self.logger.info("Incremented overall average count")
+                        WHERE id = (SELECT MAX(id) FROM overall_average)
+                    ''', (usage,))
+                    if cursor.rowcount == 0:
+                        cursor.execute('''
+                            INSERT INTO overall_average (count, last_updated)
+                            VALUES (?, CURRENT_TIMESTAMP)
+                        ''', (usage,))
+
+                if grade_stats:
+                    cursor.executemany('''
+                        INSERT OR REPLACE INTO grade_stats
+                            (specialization, level, count, mean, m2, minimum, maximum, histogram, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ''', grade_stats)
+
+                conn.commit()
+                self.counters.add(VISITORS_COUNTER, new_visitors)
+                self.counters.add(USAGE_COUNTER, usage)
+                self.logger.info(f"Flushed {len(visits)} visitor updates and {usage} usage increments")
         except sqlite3.Error as e:
-            self.logger.error(f"Error incrementing overall average count: {str(e)}")
+            self.logger.error(f"Error recording counter batch: {str(e)}")
             raise
 
-    def get_all_user_ids(self) -> List[int]:
-        """Get all user IDs with proper error handling"""
-        try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT user_id FROM visitors')
-                    return [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            self.logger.error(f"Error getting user IDs: {str(e)}")
-            return []
+    def load_grade_stats(self) -> List[StatsRow]:
+        """Load the persisted grade distributions"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT specialization, level, count, mean, m2, minimum, maximum, histogram
+                FROM grade_stats
+            ''')
+            return cursor.fetchall()
+
+    def get_user_id_page(self, after_user_id: int = 0, limit: int = 500) -> List[int]:
+        """Get the next page of user IDs greater than after_user_id (keyset pagination)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT user_id FROM visitors WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                (after_user_id, limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def iter_user_id_pages(self, after_user_id: int = 0, page_size: int = 500) -> Iterator[List[int]]:
+        """Stream all user IDs in ascending pages without loading them at once"""
+        while True:
+            page = self.get_user_id_page(after_user_id, page_size)
+            if not page:
+                return
+            yield page
+            after_user_id = page[-1]
 
     def update_user_stats(self, user_id: int, average_grade: float):
         """Update user statistics with caching"""
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
                     
-                    # Update user stats with UPSERT
-                    cursor.execute('''
-                        INSERT INTO user_stats (user_id, total_calculations, last_calculation, average_grade)
-                        VALUES (?, 1, CURRENT_TIMESTAMP, ?)
-                        ON CONFLICT(user_id) DO UPDATE SET
-                            total_calculations = total_calculations + 1,
-                            last_calculation = CURRENT_TIMESTAMP,
-                            average_grade = (average_grade * total_calculations + ?) / (total_calculations + 1)
-                    ''', (user_id, average_grade, average_grade))
+                # Update user stats with UPSERT
+                cursor.execute('''
+                    INSERT INTO user_stats (user_id, total_calculations, last_calculation, average_grade)
+                    VALUES (?, 1, CURRENT_TIMESTAMP, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        total_calculations = total_calculations + 1,
+                        last_calculation = CURRENT_TIMESTAMP,
+                        average_grade = (average_grade * total_calculations + ?) / (total_calculations + 1)
+                ''', (user_id, average_grade, average_grade))
                     
-                    conn.commit()
-                    self.logger.info(f"Updated stats for user {user_id}")
+                conn.commit()
+                self.logger.info(f"Updated stats for user {user_id}", extra=SAMPLED)
         except sqlite3.Error as e:
             self.logger.error(f"Error updating user stats: {str(e)}")
             raise
@@ -236,23 +315,22 @@ class Database:
     def get_user_stats(self, user_id: int) -> Optional[Dict]:
         """Get user statistics with caching"""
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        SELECT total_calculations, last_calculation, average_grade
-                        FROM user_stats
-                        WHERE user_id = ?
-                    ''', (user_id,))
-                    result = cursor.fetchone()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT total_calculations, last_calculation, average_grade
+                    FROM user_stats
+                    WHERE user_id = ?
+                ''', (user_id,))
+                result = cursor.fetchone()
                     
-                    if result:
-                        return {
-                            'total_calculations': result[0],
-                            'last_calculation': result[1],
-                            'average_grade': result[2]
-                        }
-                    return None
+                if result:
+                    return {
+                        'total_calculations': result[0],
+                        'last_calculation': result[1],
+                        'average_grade': result[2]
+                    }
+                return None
         except sqlite3.Error as e:
             self.logger.error(f"Error getting user stats: {str(e)}")
             return None
@@ -260,45 +338,369 @@ class Database:
     def cleanup_old_data(self, days: int = 30):
         """Clean up old data to maintain database performance"""
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
                     
-                    # Delete old visitor records
-                    cursor.execute('''
-                        DELETE FROM visitors
-                        WHERE last_visit < datetime('now', ?)
-                    ''', (f'-{days} days',))
+                # Delete old visitor records
+                cursor.execute('''
+                    DELETE FROM visitors
+                    WHERE last_visit < datetime('now', ?)
+                ''', (f'-{days} days',))
                     
-                    # Delete old user stats
-                    cursor.execute('''
-                        DELETE FROM user_stats
-                        WHERE last_calculation < datetime('now', ?)
-                    ''', (f'-{days} days',))
+                # Delete old user stats
+                cursor.execute('''
+                    DELETE FROM user_stats
+                    WHERE last_calculation < datetime('now', ?)
+                ''', (f'-{days} days',))
                     
-                    conn.commit()
-                    self.logger.info(f"Cleaned up data older than {days} days")
+                conn.commit()
+                self.counters.invalidate(VISITORS_COUNTER)
+                self.logger.info(f"Cleaned up data older than {days} days")
         except sqlite3.Error as e:
             self.logger.error(f"Error cleaning up old data: {str(e)}")
             raise
 
     def remove_user_from_database(self, user_id: int):
         """Remove user from database"""
+        self.remove_users_from_database([user_id])
+
+    def remove_users_from_database(self, user_ids: List[int]):
+        """Remove a batch of users from database in one transaction"""
+        if not user_ids:
+            return
+        rows = [(user_id,) for user_id in user_ids]
+        try:
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany("DELETE FROM visitors WHERE user_id = ?", rows)
+                removed = cursor.rowcount
+                cursor.executemany("DELETE FROM user_stats WHERE user_id = ?", rows)
+                cursor.executemany("DELETE FROM user_profiles WHERE user_id = ?", rows)
+                conn.commit()
+                self.counters.add(VISITORS_COUNTER, -removed)
+                self.logger.info(f"Removed {removed} users from database")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error removing users from database: {str(e)}")
+            raise
+
+    def get_user_profile(self, user_id: int) -> Optional[Profile]:
+        """Get the specialization and level the user chose last time"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT specialization, level FROM user_profiles WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return (row[0], row[1]) if row else None
+
+    def save_user_profile(self, user_id: int, specialization: str, level: str):
+        """Remember the specialization and level the user just chose"""
+        try:
+            with self.lock, self.pool.connection() as conn:
+                conn.execute('''
+                    INSERT INTO user_profiles (user_id, specialization, level)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        specialization = excluded.specialization,
+                        level = excluded.level,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (user_id, specialization, level))
+                conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving user profile: {str(e)}")
+            raise
+
+    def load_persisted_user_data(self) -> Dict[int, bytes]:
+        """Load every serialized user_data entry"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id, data FROM persisted_user_data')
+            return dict(cursor.fetchall())
+
+    def load_persisted_conversations(self, name: str) -> List[Tuple[str, int]]:
+        """Load the (key, state) pairs stored for one conversation handler"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, state FROM persisted_conversations WHERE name = ?', (name,))
+            return cursor.fetchall()
+
+    def save_persisted_state(self, user_data: Dict[int, Optional[bytes]],
+                             conversations: Dict[Tuple[str, str], Optional[int]]):
+        """Write dirty user_data and conversation rows in one transaction; None deletes the row"""
+        try:
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO persisted_user_data (user_id, data, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        data = excluded.data,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [(user_id, data) for user_id, data in user_data.items() if data is not None])
+                cursor.executemany(
+                    'DELETE FROM persisted_user_data WHERE user_id = ?',
+                    [(user_id,) for user_id, data in user_data.items() if data is None]
+                )
+                cursor.executemany('''
+                    INSERT INTO persisted_conversations (name, key, state, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(name, key) DO UPDATE SET
+                        state = excluded.state,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [(name, key, state) for (name, key), state in conversations.items() if state is not None])
+                cursor.executemany(
+                    'DELETE FROM persisted_conversations WHERE name = ? AND key = ?',
+                    [(name, key) for (name, key), state in conversations.items() if state is None]
+                )
+                conn.commit()
+                self.logger.info(f"Persisted {len(user_data)} user_data and {len(conversations)} conversation changes")
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving persisted state: {str(e)}")
+            raise
+
+    def create_broadcast_job(self, message: str, parse_mode: Optional[str] = None,
+                             owner: Optional[str] = None, lease_seconds: float = 0) -> int:
+        """Create a broadcast job leased to ``owner`` and return its id"""
+        with self.lock, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO broadcast_jobs (message, parse_mode, lease_owner, lease_expires_at) VALUES (?, ?, ?, ?)',
+                (message, parse_mode, owner, time.time() + lease_seconds)
+            )
+            conn.commit()
+            self.logger.info(f"Created broadcast job {cursor.lastrowid}")
+            return cursor.lastrowid
+
+    def get_unfinished_broadcast_jobs(self) -> List[Dict]:
+        """Get running broadcast jobs whose sender stopped renewing its lease"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, message, parse_mode, cursor, sent, blocked, failed
+                FROM broadcast_jobs
+                WHERE status = 'running'
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY id
+            ''', (time.time(),))
+            columns = ('id', 'message', 'parse_mode', 'cursor', 'sent', 'blocked', 'failed')
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def claim_broadcast_job(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        """Take over a running job whose lease expired; False if another process holds it"""
+        now = time.time()
+        with self.lock, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcast_jobs
+                SET lease_owner = ?, lease_expires_at = ?
+                WHERE id = ? AND status = 'running'
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            ''', (owner, now + lease_seconds, job_id, now))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def renew_broadcast_lease(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        """Extend ``owner``'s lease on a job; False once the lease was lost"""
+        with self.lock, self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcast_jobs
+                SET lease_expires_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            ''', (time.time() + lease_seconds, job_id, owner))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def get_broadcast_deliveries_after(self, job_id: int, after_user_id: int) -> Set[int]:
+        """Get users past the job cursor who were already handled before an interruption"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT user_id FROM broadcast_deliveries WHERE job_id = ? AND user_id > ?',
+                (job_id, after_user_id)
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def record_broadcast_progress(self, job_id: int, deliveries: List[Tuple[int, str]],
+                                  sent: int, blocked: int, failed: int,
+                                  cursor_position: Optional[int] = None, status: Optional[str] = None,
+                                  owner: Optional[str] = None) -> bool:
+        """Store a batch of delivery results and advance the job checkpoint in one transaction.
+
+        With ``owner`` the checkpoint only moves while that owner holds the
+        lease; returns False when it does not. Delivery results are kept
+        either way, since those messages were sent.
+        """
         try:
-            with self.lock:
-                with closing(sqlite3.connect(self.db_path)) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM visitors WHERE user_id = ?", (user_id,))
-                    cursor.execute("DELETE FROM user_stats WHERE user_id = ?", (user_id,))
-                    conn.commit()
-                    self.logger.info(f"Removed user {user_id} from database")
+            with self.lock, self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    'INSERT OR REPLACE INTO broadcast_deliveries (job_id, user_id, status) VALUES (?, ?, ?)',
+                    [(job_id, user_id, delivery_status) for user_id, delivery_status in deliveries]
+                )
+                cursor.execute('''
+                    UPDATE broadcast_jobs
+                    SET sent = ?, blocked = ?, failed = ?,
+                        cursor = COALESCE(?, cursor),
+                        status = COALESCE(?, status),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND (? IS NULL OR lease_owner = ?)
+                ''', (sent, blocked, failed, cursor_position, status, job_id, owner, owner))
+                conn.commit()
+                return cursor.rowcount == 1
         except sqlite3.Error as e:
-            self.logger.error(f"Error removing user from database: {str(e)}")
+            self.logger.error(f"Error recording broadcast progress: {str(e)}")
             raise
 
     def close(self):
-        """Close database connection"""
+        """Close pooled database connections"""
+        self.pool.close()
         self.logger.info("Database connection closed")
 
+class AsyncDatabase:
+    """Awaitable facade over Database that keeps SQLite off the event loop.
+
+    Writes are serialized on a single dedicated writer thread, reads run on a
+    small thread pool sized to the connection pool. Visitor and usage counters
+    and grade statistics go through a write-behind buffer and are persisted
+    in batches.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 2.0, flush_max_events: int = 500,
+                 profile_cache_size: int = 10000):
+        self.sync = db
+        self.profiles = ProfileCache(profile_cache_size)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=db.pool.size, thread_name_prefix='db-reader')
+        self.counters = WriteBehindBuffer(self._flush_counters, flush_interval, flush_max_events)
+        self.stats = StatsEngine(db.load_grade_stats())
+
+    def start(self):
+        """Start background work; must be called from the running event loop"""
+        self.counters.start()
+
+    async def _flush_counters(self, visits: Dict[int, int], usage: int):
+        grade_stats = self.stats.dirty_rows()
+        try:
+            await self._write(self.sync.record_counters, visits, usage, grade_stats)
+        except BaseException:
+            self.stats.mark_dirty(grade_stats)
+            raise
+
+    async def _run(self, executor: ThreadPoolExecutor, func: Callable, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(func, *args))
+
+    async def _read(self, func: Callable, *args: Any) -> Any:
+        return await self._run(self._readers, func, *args)
+
+    async def _write(self, func: Callable, *args: Any) -> Any:
+        return await self._run(self._writer, func, *args)
+
+    async def get_visitor_count(self) -> int:
+        cached = self.sync.counters.peek(VISITORS_COUNTER)
+        if cached is not None:
+            return cached
+        return await self._read(self.sync.get_visitor_count)
+
+    async def update_visitors(self, user_id: int):
+        self.counters.add_visit(user_id)
+
+    async def get_overall_average_count(self) -> int:
+        count = self.sync.counters.peek(USAGE_COUNTER)
+        if count is None:
+            count = await self._read(self.sync.get_overall_average_count)
+        return count + self.counters.pending_usage
+
+    async def increment_overall_average_count(self):
+        self.counters.add_usage()
+
+    async def record_calculation(self, specialization: str, level: str, average: float):
+        """Count a finished calculation and add it to the grade statistics"""
+        self.stats.record(specialization, level, average)
+        self.counters.add_usage()
+
+    async def get_user_id_page(self, after_user_id: int = 0, limit: int = 500) -> List[int]:
+        return await self._read(self.sync.get_user_id_page, after_user_id, limit)
+
+    async def iter_user_id_pages(self, after_user_id: int = 0, page_size: int = 500) -> AsyncIterator[List[int]]:
+        """Async variant of Database.iter_user_id_pages; each page is one read"""
+        while True:
+            page = await self.get_user_id_page(after_user_id, page_size)
+            if not page:
+                return
+            yield page
+            after_user_id = page[-1]
+
+    async def update_user_stats(self, user_id: int, average_grade: float):
+        await self._write(self.sync.update_user_stats, user_id, average_grade)
+
+    async def get_user_stats(self, user_id: int) -> Optional[Dict]:
+        return await self._read(self.sync.get_user_stats, user_id)
+
+    async def cleanup_old_data(self, days: int = 30):
+        await self._write(self.sync.cleanup_old_data, days)
+
+    async def remove_user_from_database(self, user_id: int):
+        await self.remove_users_from_database([user_id])
+
+    async def remove_users_from_database(self, user_ids: List[int]):
+        await self._write(self.sync.remove_users_from_database, user_ids)
+        for user_id in user_ids:
+            self.profiles.discard(user_id)
+
+    async def get_user_profile(self, user_id: int) -> Optional[Profile]:
+        profile = self.profiles.get(user_id)
+        if profile is ProfileCache.MISSING:
+            profile = await self._read(self.sync.get_user_profile, user_id)
+            self.profiles.put(user_id, profile)
+        return profile
+
+    async def save_user_profile(self, user_id: int, specialization: str, level: str):
+        """Store the user's choice, skipping the write when it did not change"""
+        profile = (specialization, level)
+        if self.profiles.get(user_id) == profile:
+            return
+        await self._write(self.sync.save_user_profile, user_id, specialization, level)
+        self.profiles.put(user_id, profile)
+
+    async def load_persisted_user_data(self) -> Dict[int, bytes]:
+        return await self._read(self.sync.load_persisted_user_data)
+
+    async def load_persisted_conversations(self, name: str) -> List[Tuple[str, int]]:
+        return await self._read(self.sync.load_persisted_conversations, name)
+
+    async def save_persisted_state(self, user_data: Dict[int, Optional[bytes]],
+                                   conversations: Dict[Tuple[str, str], Optional[int]]):
+        await self._write(self.sync.save_persisted_state, user_data, conversations)
+
+    async def create_broadcast_job(self, message: str, parse_mode: Optional[str] = None,
+                                   owner: Optional[str] = None, lease_seconds: float = 0) -> int:
+        return await self._write(self.sync.create_broadcast_job, message, parse_mode, owner, lease_seconds)
+
+    async def get_unfinished_broadcast_jobs(self) -> List[Dict]:
+        return await self._read(self.sync.get_unfinished_broadcast_jobs)
+
+    async def claim_broadcast_job(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        return await self._write(self.sync.claim_broadcast_job, job_id, owner, lease_seconds)
+
+    async def renew_broadcast_lease(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        return await self._write(self.sync.renew_broadcast_lease, job_id, owner, lease_seconds)
+
+    async def get_broadcast_deliveries_after(self, job_id: int, after_user_id: int) -> Set[int]:
+        return await self._read(self.sync.get_broadcast_deliveries_after, job_id, after_user_id)
+
+    async def record_broadcast_progress(self, job_id: int, deliveries: List[Tuple[int, str]],
+                                        sent: int, blocked: int, failed: int,
+                                        cursor_position: Optional[int] = None, status: Optional[str] = None,
+                                        owner: Optional[str] = None) -> bool:
+        return await self._write(self.sync.record_broadcast_progress, job_id, deliveries,
+                                 sent, blocked, failed, cursor_position, status, owner)
+
+    async def close(self):
+        """Flush buffered counters and drain pending operations, then close"""
+        await self.counters.close()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
+
 # Define what can be imported from this module
-__all__ = ['Database'] 
+__all__ = ['Database', 'AsyncDatabase', 'ConnectionPool'] 
@@ -1,34 +1,68 @@
 from telegram import Update, Bot
 from telegram.ext import ContextTypes
-from telegram.error import Forbidden, BadRequest
+from telegram.error import BadRequest
+from typing import Dict, Tuple
+import asyncio
 import logging
+import time
+
+from logging_setup import SAMPLED
 
 # قائمة القنوات
 CHANNELS = ["@HQLaptop", "@infotouchcommunity"]
 logger = logging.getLogger(__name__)
 
+# مدة صلاحية نتيجة التحقق من الاشتراك (بالثواني)
+SUBSCRIBED_TTL = 600
+# يُطبق فقط على نتيجة "user not found"
+NOT_SUBSCRIBED_TTL = 30
+SUBSCRIPTION_CACHE_LIMIT = 50000
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+# user_id -> (subscribed, expires_at)
+_subscription_cache: Dict[int, Tuple[bool, float]] = {}
+
+def _cache_subscription(user_id: int, subscribed: bool):
+    now = time.monotonic()
+    if len(_subscription_cache) >= SUBSCRIPTION_CACHE_LIMIT:
+        for key in [key for key, (_, expires_at) in _subscription_cache.items() if expires_at <= now]:
+            del _subscription_cache[key]
+        if len(_subscription_cache) >= SUBSCRIPTION_CACHE_LIMIT:
+            _subscription_cache.clear()
+    _subscription_cache[user_id] = (subscribed, now + (SUBSCRIBED_TTL if subscribed else NOT_SUBSCRIBED_TTL))
+
+async def _is_channel_member(bot: Bot, channel: str, user_id: int) -> bool:
+    member = await bot.get_chat_member(chat_id=channel, user_id=user_id)
+    if member.status not in MEMBER_STATUSES:
+        logger.warning(f"User {user_id} not in {channel}", extra=SAMPLED)
+        return False
+    return True
+
 async def is_subscribed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """التحقق مما إذا كان المستخدم مشتركًا في القنوات المطلوبة."""
     user_id = update.message.from_user.id
     # Get the bot instance from the context
     bot = context.bot
-    
+
+    cached = _subscription_cache.get(user_id)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
     try:
-        # التحقق من الاشتراك في القناة الأولى
-        member1 = await bot.get_chat_member(chat_id=CHANNELS[0], user_id=user_id)
-        if member1.status not in ['member', 'administrator', 'creator']:
-            logger.warning(f"User {user_id} not in {CHANNELS[0]}")
-            return False
+        # التحقق من الاشتراك في جميع القنوات في نفس الوقت
+        results = await asyncio.gather(
+            *(_is_channel_member(bot, channel, user_id) for channel in CHANNELS),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        subscribed = all(results)
 
-        # التحقق من الاشتراك في القناة الثانية
-        member2 = await bot.get_chat_member(chat_id=CHANNELS[1], user_id=user_id)
-        if member2.status not in ['member', 'administrator', 'creator']:
-            logger.warning(f"User {user_id} not in {CHANNELS[1]}")
-            return False
-            
     except BadRequest as e:
         if "user not found" in e.message.lower():
-            logger.warning(f"User {user_id} not found in one of the channels (BadRequest).")
+            logger.warning(f"User {user_id} not found in one of the channels (BadRequest).", extra=SAMPLED)
+            _cache_subscription(user_id, False)
             return False
         else:
             logger.error(f"A BadRequest occurred for user {user_id}: {e}")
@@ -39,23 +73,16 @@ async def is_subscribed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> b
         logger.error(f"An unexpected error occurred in is_subscribed for user {user_id}: {e}")
         await update.message.reply_text("An unexpected error occurred. Please contact support.")
         return False
-        
-    return True
+
+    # A non-member is told to subscribe and press /start again, so that
+    # retry must reach the API instead of a cached rejection
+    if subscribed:
+        _cache_subscription(user_id, subscribed)
+    return subscribed
 
 async def notify_users(context: ContextTypes.DEFAULT_TYPE):
     """إرسال إشعارات للمستخدمين."""
-    # Get db and bot from the context
-    db = context.db
-    bot = context.bot
-    
-    user_ids = db.get_all_user_ids()
+    from broadcast import Broadcaster
+
     message = "🎉 **New Patch Release!** 🎉\n\nHello everyone! We're excited to announce a new update..."
-    
-    for user_id in user_ids:
-        try:
-            await bot.send_message(chat_id=user_id, text=message, parse_mode='Markdown')
-        except Forbidden:
-            logger.warning(f"User {user_id} has blocked the bot. Removing from the database.")
-            db.remove_user(user_id)
-        except Exception as e:
-            logger.error(f"Failed to send message to user {user_id}: {e}") 
+    return await Broadcaster(context.bot, context.db).run(message, parse_mode='Markdown')
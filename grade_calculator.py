@@ -1,14 +1,47 @@
-import math
+import csv
+import html
+import io
 import logging
 import asyncio
+from typing import List, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler
 from retrying import retry
 from telegram.error import TimedOut
-from specializations import specializations, exam1_subjects, exam2_subjects, td_subjects, tp_subjects, subject_with_cc, special_subjects, levelsWithSubLevels
+from specializations import specializations
+from curriculum import LEVEL_SPECIALIZATIONS, LEVELS_WITH_SUB_LEVELS, get_subjects, has_level
+from session import SESSION_KEY, GradeSession
+from replies import Reply
+from calculator import (
+    PASSING_AVERAGE,
+    overall_average,
+    rattrapage_requirements,
+    required_average,
+    round_average,
+    subject_average,
+)
 
 # تعريف حالات المحادثة
-SPECIALIZATION, LEVEL, SUB_LEVEL, FIRST, SECOND, TP, TD, NEXT_SUBJECT = range(8)
+SPECIALIZATION, LEVEL, SUB_LEVEL, FIRST, SECOND, TP, TD, NEXT_SUBJECT, BULK = range(9)
+
+# أقل عدد من النتائج قبل عرض المقارنة مع الطلبة الآخرين
+MIN_COMPARISON_SAMPLE = 20
+
+# الحد الأقصى لحجم ملف CSV المرسل في وضع الإدخال الدفعي
+MAX_BULK_FILE_SIZE = 64 * 1024
+BULK_TIP = "\n\n💡 Tip: send /bulk to enter all your grades in one message."
+
+# مستويات لم تتم إضافة موادها بعد، ومستويات لن يتم دعمها
+NOT_ADDED_LEVELS = frozenset({
+    "sciences4 (+4)", "sciences4 (+5)", "sciences5",
+    "physics4 (+4)", "physics5",
+    "math4 (+4)", "math5",
+    "info5",
+})
+# زر تخطي اختيار التخصص والمستوى للمستخدمين العائدين
+SAME_AS_LAST_TIME = "🔁 Same as last time"
+
+NOT_SUPPORTED_LEVELS = frozenset({"musique1", "musique2", "musique3", "musique4 (+4)", "musique4 (+5)", "musique5"})
 
 def validate_grade(grade: str) -> bool:
     """التحقق من صحة الدرجة المدخلة"""
@@ -25,13 +58,34 @@ def get_menu_keyboard():
         [InlineKeyboardButton("Follow us on Instagram", url='https://www.instagram.com/Hq.laptop')]
     ])
 
+def is_available(specialization: str, level: str) -> bool:
+    """هل يمكن حساب المعدل لهذا المستوى حاليًا"""
+    return has_level(specialization, level) and level not in NOT_ADDED_LEVELS and level not in NOT_SUPPORTED_LEVELS
+
+def not_listed_reply() -> Reply:
+    """رد موحد للمستويات التي لم تتم إضافتها بعد"""
+    return Reply().add_text("لم يتم اضافة هذا التخصص بعد، يرجى الانتظار.").add_text(
+        "This level is not listed yet, Please wait for upcoming updates."
+    )
+
+def format_comparison(stats, average: float) -> str:
+    """مقارنة المعدل مع معدلات الطلبة الآخرين في نفس المستوى"""
+    if stats is None or stats.count < MIN_COMPARISON_SAMPLE:
+        return ""
+    rank = stats.percentile_rank(average) * 100
+    return f"\n📊 Better than {rank:.0f}% of {stats.count} students at this level"
+
+def get_session(context: ContextTypes.DEFAULT_TYPE) -> GradeSession:
+    """جلب حالة الحساب الحالية للمستخدم"""
+    return context.user_data[SESSION_KEY]
+
 @retry(wait_fixed=2000, stop_max_attempt_number=5, retry_on_exception=lambda x: isinstance(x, TimedOut))
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """بدء البوت والتحقق من الاشتراك"""
     from error_handler import is_subscribed, CHANNELS
     
     user_id = update.message.from_user.id
-    context.db.update_visitors(user_id)
+    await context.db.update_visitors(user_id)
 
     # 🔹 التحقق من الاشتراك في جميع القنوات
     if not await is_subscribed(update, context):
@@ -44,6 +98,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             "🔹 بعد الاشتراك، اضغط على /start من جديد.",
             reply_markup=reply_markup
         )
+        context.user_data.pop(SESSION_KEY, None)
         return ConversationHandler.END
 
     # ✅ المستخدم مشترك في القنوات، يكمل العملية
@@ -54,6 +109,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         ["Sciences"],
         ["Musique"]
     ]
+    shortcut = ""
+    profile = await context.db.get_user_profile(user_id)
+    if profile is not None and is_available(*profile):
+        # المستخدم العائد يمكنه تخطي اختيار التخصص والمستوى بضغطة واحدة
+        keyboard.insert(0, [f"{SAME_AS_LAST_TIME} ({profile[1].capitalize()})"])
+        shortcut = f"Or tap \"{SAME_AS_LAST_TIME}\" to calculate for {profile[1].capitalize()} again.\n\n"
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
     await update.message.reply_text(
         "Hello! Welcome to the Grade Calculator Bot. 🎓\n\n"
@@ -63,21 +124,32 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         "- Info\n"
         "- Sciences\n"
         "- Musique\n\n"
+        f"{shortcut}"
         "If you need any help, type /help. To cancel the process at any time, type /cancel.",
         reply_markup=reply_markup,
     )
     return SPECIALIZATION
 
+async def repeat_last_level(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """إعادة الحساب بنفس التخصص والمستوى المستخدمين في المرة السابقة"""
+    profile = await context.db.get_user_profile(update.message.from_user.id)
+    if profile is None or not is_available(*profile):
+        await update.message.reply_text("Please choose a valid specialization.")
+        return SPECIALIZATION
+
+    specialization, level = profile
+    context.user_data[SESSION_KEY] = GradeSession(specialization)
+    return await begin_level(update, context, level)
+
 async def choose_specialization(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """اختيار التخصص"""
-    user_data = context.user_data
     specialization = update.message.text.lower()
 
     if specialization not in specializations:
         await update.message.reply_text("Please choose a valid specialization.")
         return SPECIALIZATION
 
-    user_data['specialization'] = specialization
+    context.user_data[SESSION_KEY] = GradeSession(specialization)
     keyboard = [[f"{specialization.capitalize()}1"], [f"{specialization.capitalize()}2"], [f"{specialization.capitalize()}3"], [f"{specialization.capitalize()}4"],[f"{specialization.capitalize()}5"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
     await update.message.reply_text("Please choose your level:", reply_markup=reply_markup)
@@ -85,143 +157,126 @@ async def choose_specialization(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def choose_level(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """اختيار المستوى"""
-    user_data = context.user_data
+    session = get_session(context)
     level = update.message.text.lower()
 
-    not_added_levels = [ "sciences4 (+4)", "sciences4 (+5)", "sciences5",
-                    "physics4 (+4)", "physics5",
-                    "math4 (+4)", "math5",
-                    "info5"]
-    not_supported_levels = ["musique1", "musique2", "musique3", "musique4 (+4)", "musique4 (+5)", "musique5"]
-
-    if level in not_added_levels:
-        await update.message.reply_text("لم يتم اضافة هذا التخصص بعد، يرجى الانتظار.")
-        await update.message.reply_text("This level is not listed yet, Please wait for upcoming updates.")
+    if level in NOT_ADDED_LEVELS:
+        await not_listed_reply().send(update.message)
+        context.user_data.pop(SESSION_KEY, None)
         return ConversationHandler.END
 
-    if level in not_supported_levels:
-        await update.message.reply_text("<b>هذا التخصص لن يتم دعمه.</b>", parse_mode='HTML')
-        await update.message.reply_text(
+    if level in NOT_SUPPORTED_LEVELS:
+        await Reply().add("<b>هذا التخصص لن يتم دعمه.</b>").add(
             "الحمد لله، والصلاة والسلام على رسول الله، وعلى آله، وصحبه، أما بعد:\n\n"
             "فالموسيقى لا تجوز دراستها، ولا تدريسها للكبار، ولا للصغار، وراجع في ذلك الفتاوى ذوات الأرقام التالية: "
             "<a href=\"https://www.islamweb.net/ar/fatwa/7932/\">7932</a>، "
             "<a href=\"https://www.islamweb.net/ar/fatwa/73834/\">73834</a>، "
             "<a href=\"https://www.islamweb.net/ar/fatwa/191797/\">المصدر</a>"
-        , parse_mode='HTML')
+        ).send(update.message)
+        context.user_data.pop(SESSION_KEY, None)
         return ConversationHandler.END
 
-    specialization = user_data['specialization']
-    if level in levelsWithSubLevels:
-        user_data['level_base'] = level
+    if level in LEVELS_WITH_SUB_LEVELS:
+        session.level_base = level
         keyboard = [["+4"], ["+5"]]
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
         await update.message.reply_text("Please choose your sub-level:", reply_markup=reply_markup)
         return SUB_LEVEL
 
-    if level not in specializations[specialization]:
+    if not has_level(session.specialization, level):
         await update.message.reply_text("Please choose a valid level.")
         return LEVEL
 
-    user_data['level'] = level
-    user_data['current_subject_index'] = 0
-    user_data['subject_grades'] = {}
-    user_data['total_grades'] = 0
-    user_data['total_coefficients'] = 0
-
-    return await ask_for_grades(update, context)
+    return await begin_level(update, context, level)
 
 async def choose_sub_level(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """اختيار المستوى الفرعي"""
-    user_data = context.user_data
+    session = get_session(context)
     sub_level = update.message.text.lower()
-    not_added_levels = ["sciences4 (+4)", "sciences4 (+5)", "sciences5",
-                    "physics4 (+4)", "physics5",
-                    "math4 (+4)", "math5",
-                    "info5"]
     if sub_level not in ["+4", "+5"]:
         await update.message.reply_text("Please choose a valid sub-level.")
         return SUB_LEVEL
 
-    level_base = user_data['level_base']
+    level_base = session.level_base
     if sub_level == "+4":
-        if f"{level_base} (+4)" in not_added_levels:
-            await update.message.reply_text("لم يتم اضافة هذا التخصص بعد، يرجى الانتظار.")
-            await update.message.reply_text("This level is not listed yet, Please wait for upcoming updates.")
+        if f"{level_base} (+4)" in NOT_ADDED_LEVELS:
+            await not_listed_reply().send(update.message)
+            context.user_data.pop(SESSION_KEY, None)
             return ConversationHandler.END
-        user_data['level'] = f"{level_base} (+4)"
+        return await begin_level(update, context, f"{level_base} (+4)")
     elif sub_level == "+5":
-        if f"{level_base} (+5)" in not_added_levels:
-            await update.message.reply_text("لم يتم اضافة هذا التخصص بعد، يرجى الانتظار.")
-            await update.message.reply_text("This level is not listed yet, Please wait for upcoming updates.")
+        if f"{level_base} (+5)" in NOT_ADDED_LEVELS:
+            await not_listed_reply().send(update.message)
+            context.user_data.pop(SESSION_KEY, None)
             return ConversationHandler.END
-        user_data['level'] = f"{level_base} (+5)"
-
-    user_data['current_subject_index'] = 0
-    user_data['subject_grades'] = {}
-    user_data['total_grades'] = 0
-    user_data['total_coefficients'] = 0
+        return await begin_level(update, context, f"{level_base} (+5)")
 
+async def begin_level(update: Update, context: ContextTypes.DEFAULT_TYPE, level: str) -> int:
+    """بدء إدخال الدرجات لمستوى محدد وحفظه كاختيار المستخدم الأخير"""
+    session = get_session(context)
+    session.begin(level)
+    await context.db.save_user_profile(update.message.from_user.id, session.specialization, level)
     return await ask_for_grades(update, context)
 
 async def ask_for_grades(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """طلب الدرجات من المستخدم"""
-    user_data = context.user_data
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
+    session = get_session(context)
+    subjects = get_subjects(session.specialization, session.level)
+    current_index = session.index
 
     if current_index >= len(subjects):
-        if user_data['total_coefficients'] == 0:
+        context.user_data.pop(SESSION_KEY, None)
+        if session.total_coefficients == 0:
             await update.message.reply_text("No subjects found for this level.")
             return ConversationHandler.END
 
-        average = user_data['total_grades'] / user_data['total_coefficients']
-        context.db.increment_overall_average_count()
-        await update.message.reply_text("<b>---------------------------------------------</b>", parse_mode='HTML')
-        average = math.ceil(average * 100) / 100
-        await update.message.reply_text(f"<b>Your overall average grade is: <span class=\"tg-spoiler\">{average:.2f}</span></b>", parse_mode='HTML')
+        average = round_average(session.average)
+        comparison = format_comparison(context.db.stats.get(session.specialization, session.level), average)
+        await context.db.record_calculation(session.specialization, session.level, average)
+        # النتيجة كاملة في رسالة واحدة بدل أربع رسائل
+        reply = Reply().add("<b>---------------------------------------------</b>")
+        reply.add(f"<b>Your overall average grade is: <span class=\"tg-spoiler\">{average:.2f}</span></b>{comparison}")
 
         if average >= 10.00:
-            await update.message.reply_text("<b><span class=\"tg-spoiler\">Congratulations!! YA LKHABACH</span></b>", parse_mode='HTML')
+            reply.add("<b><span class=\"tg-spoiler\">Congratulations!! YA LKHABACH</span></b>")
         else:
-            await update.message.reply_text("<b><span class=\"tg-spoiler\">Don't worry, Rana ga3 f rattrapage.</span></b>", parse_mode='HTML')
+            reply.add("<b><span class=\"tg-spoiler\">Don't worry, Rana ga3 f rattrapage.</span></b>")
 
-        await update.message.reply_text(
+        reply.add(
             "<b>Thank you for using our bot</b>\n\n"
-            "<b>Developed by <a href=\"https://www.instagram.com/yassine_boukerma\">Yassine Boukerma</a> with ❤️</b>",
-            reply_markup=get_menu_keyboard(),
-            parse_mode='HTML'
+            "<b>Developed by <a href=\"https://www.instagram.com/yassine_boukerma\">Yassine Boukerma</a> with ❤️</b>"
         )
+        await reply.markup(get_menu_keyboard()).send(update.message)
 
         return ConversationHandler.END
 
-    subject = subjects[current_index]
-    coefficient = specializations[specialization][level][subject]
+    record = subjects[current_index]
+    subject, coefficient = record.name, record.coefficient
+    tip = BULK_TIP if current_index == 0 else ""
     
-    if subject in special_subjects:
+    if record.direct_average:
         await update.message.reply_text(
-            f"Please enter your average grade for <b>{subject}</b> (coefficient: {coefficient}):",
+            f"Please enter your average grade for <b>{subject}</b> (coefficient: {coefficient}):{tip}",
             parse_mode='HTML'
         )
         return NEXT_SUBJECT
     
-    if subject in exam1_subjects and subject in exam2_subjects:
+    if record.two_exams:
         await update.message.reply_text(
-            f"Please enter your first exam grade for <b>{subject}</b> (coefficient: {coefficient}):",
+            f"Please enter your first exam grade for <b>{subject}</b> (coefficient: {coefficient}):{tip}",
             parse_mode='HTML'
         )
         return FIRST
     else:
         await update.message.reply_text(
-            f"Please enter your exam grade for <b>{subject}</b> (coefficient: {coefficient}):",
+            f"Please enter your exam grade for <b>{subject}</b> (coefficient: {coefficient}):{tip}",
             parse_mode='HTML'
         )
         return FIRST
 
 async def receive_first_grade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """استقبال الدرجة الأولى"""
-    user_data = context.user_data
+    session = get_session(context)
     grade_text = update.message.text
     
     if not validate_grade(grade_text):
@@ -229,28 +284,19 @@ async def receive_first_grade(update: Update, context: ContextTypes.DEFAULT_TYPE
         return FIRST
     
     grade = float(grade_text)
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
-    subject = subjects[current_index]
+    record = get_subjects(session.specialization, session.level)[session.index]
     
-    if subject in exam1_subjects and subject in exam2_subjects:
-        user_data['first_grade'] = grade
-        await update.message.reply_text(f"Please enter your second exam grade for <b>{subject}</b>:", parse_mode='HTML')
+    if record.two_exams:
+        session.first_grade = grade
+        await update.message.reply_text(f"Please enter your second exam grade for <b>{record.name}</b>:", parse_mode='HTML')
         return SECOND
     else:
-        coefficient = specializations[specialization][level][subject]
-        user_data.setdefault('total_grades', 0)
-        user_data.setdefault('total_coefficients', 0)
-        user_data['total_grades'] += grade * coefficient
-        user_data['total_coefficients'] += coefficient
-        user_data['current_subject_index'] = current_index + 1
+        session.add_subject(subject_average(record, (grade,)), record.coefficient)
         return await ask_for_grades(update, context)
 
 async def receive_second_grade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """استقبال الدرجة الثانية"""
-    user_data = context.user_data
+    session = get_session(context)
     grade_text = update.message.text
     
     if not validate_grade(grade_text):
@@ -258,77 +304,46 @@ async def receive_second_grade(update: Update, context: ContextTypes.DEFAULT_TYP
         return SECOND
     
     grade = float(grade_text)
-    first_grade = user_data['first_grade']
-    average = (first_grade + grade) / 2
-    
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
-    subject = subjects[current_index]
-    coefficient = specializations[specialization][level][subject]
-    
-    user_data.setdefault('total_grades', 0)
-    user_data.setdefault('total_coefficients', 0)
-    user_data['total_grades'] += average * coefficient
-    user_data['total_coefficients'] += coefficient
-    user_data['current_subject_index'] = current_index + 1
+    record = get_subjects(session.specialization, session.level)[session.index]
+    session.add_subject(subject_average(record, (session.first_grade, grade)), record.coefficient)
     
     return await ask_for_grades(update, context)
 
 async def receive_tp_grade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """استقبال درجة TP"""
     # This logic seems incomplete, assuming a simple addition for now
-    user_data = context.user_data
+    session = get_session(context)
     grade_text = update.message.text
     if not validate_grade(grade_text):
         await update.message.reply_text("Please enter a valid grade between 0 and 20.")
         return TP
     
     grade = float(grade_text)
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
-    subject = subjects[current_index]
-    coefficient = specializations[specialization][level][subject]
-    
-    user_data.setdefault('total_grades', 0)
-    user_data.setdefault('total_coefficients', 0)
-    user_data['total_grades'] += grade * coefficient
-    user_data['total_coefficients'] += coefficient
-    user_data['current_subject_index'] = current_index + 1
+    record = get_subjects(session.specialization, session.level)[session.index]
+    # The single TP grade stands for every exam grade of the subject
+    session.add_subject(subject_average(record, (grade,) * record.exam_count), record.coefficient)
     
     return await ask_for_grades(update, context)
 
 async def receive_td_grade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """استقبال درجة TD"""
     # This logic seems incomplete, assuming a simple addition for now
-    user_data = context.user_data
+    session = get_session(context)
     grade_text = update.message.text
     if not validate_grade(grade_text):
         await update.message.reply_text("Please enter a valid grade between 0 and 20.")
         return TD
     
     grade = float(grade_text)
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
-    subject = subjects[current_index]
-    coefficient = specializations[specialization][level][subject]
-    
-    user_data.setdefault('total_grades', 0)
-    user_data.setdefault('total_coefficients', 0)
-    user_data['total_grades'] += grade * coefficient
-    user_data['total_coefficients'] += coefficient
-    user_data['current_subject_index'] = current_index + 1
+    record = get_subjects(session.specialization, session.level)[session.index]
+    # The single TD grade stands for every exam grade of the subject
+    session.add_subject(subject_average(record, (grade,) * record.exam_count), record.coefficient)
     
     return await ask_for_grades(update, context)
 
 async def receive_subject_average(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """استقبال متوسط المادة"""
-    user_data = context.user_data
+    session = get_session(context)
     grade_text = update.message.text
     
     if not validate_grade(grade_text):
@@ -336,23 +351,151 @@ async def receive_subject_average(update: Update, context: ContextTypes.DEFAULT_
         return NEXT_SUBJECT
     
     grade = float(grade_text)
-    specialization = user_data['specialization']
-    level = user_data['level']
-    subjects = list(specializations[specialization][level].keys())
-    current_index = user_data.get('current_subject_index', 0)
-    subject = subjects[current_index]
-    coefficient = specializations[specialization][level][subject]
-    
-    user_data.setdefault('total_grades', 0)
-    user_data.setdefault('total_coefficients', 0)
-    user_data['total_grades'] += grade * coefficient
-    user_data['total_coefficients'] += coefficient
-    user_data['current_subject_index'] = current_index + 1
+    record = get_subjects(session.specialization, session.level)[session.index]
+    session.add_subject(subject_average(record, (grade,)), record.coefficient)
     
     return await ask_for_grades(update, context)
 
+def parse_bulk_grades(subjects, rows: List[List[str]]) -> List[float]:
+    """تحويل أسطر الإدخال الدفعي إلى معدل لكل مادة، مع رفع ValueError عند الخطأ"""
+    rows = [row for row in rows if row]
+    if len(rows) != len(subjects):
+        raise ValueError(f"Expected {len(subjects)} lines (one per subject), got {len(rows)}.")
+
+    averages = []
+    for line_number, (record, row) in enumerate(zip(subjects, rows), start=1):
+        if len(row) != record.exam_count:
+            raise ValueError(f"Line {line_number} ({record.name}): expected {record.exam_count} grade(s), got {len(row)}.")
+        for value in row:
+            if not validate_grade(value):
+                raise ValueError(f"Line {line_number} ({record.name}): '{value}' is not a grade between 0 and 20.")
+        averages.append(subject_average(record, [float(value) for value in row]))
+    return averages
+
+def split_bulk_text(text: str) -> List[List[str]]:
+    """تقسيم رسالة الإدخال الدفعي إلى أسطر من الدرجات"""
+    rows = []
+    for line in text.splitlines():
+        # السماح بكتابة اسم المادة قبل النقطتين: "analyse: 12 14"
+        if ':' in line:
+            line = line.split(':', 1)[1]
+        # الفاصلة العشرية مقبولة كما في الوضع المضمن: "12,5"
+        rows.append(line.replace(',', '.').replace(';', ' ').split())
+    return rows
+
+def split_bulk_csv(content: str) -> List[List[str]]:
+    """قراءة ملف CSV: عمود اسم المادة وسطر العناوين اختياريان"""
+    rows = []
+    for row in csv.reader(io.StringIO(content)):
+        fields = [field.strip() for field in row if field.strip()]
+        if fields and not any(validate_grade(field) for field in fields):
+            continue  # سطر العناوين
+        if fields and not validate_grade(fields[0]):
+            fields = fields[1:]
+        rows.append(fields)
+    return rows
+
+async def bulk_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """إرسال قالب لإدخال جميع الدرجات في رسالة واحدة"""
+    session = get_session(context)
+    lines = []
+    for number, record in enumerate(get_subjects(session.specialization, session.level), start=1):
+        if record.direct_average:
+            expected = "average"
+        elif record.two_exams:
+            expected = "exam1 exam2"
+        else:
+            expected = "exam"
+        lines.append(f"{number}. {html.escape(record.name)} (coef {record.coefficient}): <i>{expected}</i>")
+    await update.message.reply_text(
+        "📝 <b>Send all your grades in one message</b>, one line per subject, in this order:\n\n"
+        + "\n".join(lines)
+        + "\n\nExample line: <code>12 14.5</code>\n"
+        "You can also upload a <b>.csv</b> file with the same rows.",
+        parse_mode='HTML'
+    )
+    return BULK
+
+async def _finish_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE, rows: List[List[str]]) -> int:
+    session = get_session(context)
+    subjects = get_subjects(session.specialization, session.level)
+    try:
+        averages = parse_bulk_grades(subjects, rows)
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\nPlease fix it and send all your grades again.")
+        return BULK
+
+    session.reset()
+    for record, average in zip(subjects, averages):
+        session.add_subject(average, record.coefficient)
+    return await ask_for_grades(update, context)
+
+async def receive_bulk_grades(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """استقبال جميع الدرجات في رسالة واحدة"""
+    return await _finish_bulk(update, context, split_bulk_text(update.message.text))
+
+async def receive_bulk_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """استقبال جميع الدرجات في ملف CSV"""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_BULK_FILE_SIZE:
+        await update.message.reply_text("This file is too large.")
+        return BULK
+    file = await document.get_file()
+    content = bytes(await file.download_as_bytearray()).decode('utf-8-sig', errors='replace')
+    return await _finish_bulk(update, context, split_bulk_csv(content))
+
+def describe_requirements(subjects, averages: List[float]) -> str:
+    """شرح المعدل المطلوب في المواد المتبقية أو في الاستدراك للوصول إلى 10"""
+    if len(averages) < len(subjects):
+        remaining = subjects[len(averages):]
+        needed = round_average(required_average(subjects, averages))
+        names = ", ".join(html.escape(record.name) for record in remaining)
+        if needed <= 0:
+            return f"✅ You already reach {PASSING_AVERAGE:.2f} whatever your remaining grades are."
+        if needed > 20:
+            return (f"❌ Even 20 in every remaining subject ({names}) would not be enough "
+                    f"to reach {PASSING_AVERAGE:.2f}.")
+        return (f"🎯 To reach {PASSING_AVERAGE:.2f} you need an average of at least "
+                f"<b>{needed:.2f}</b> in the remaining {len(remaining)} subject(s): {names}.")
+
+    average = round_average(overall_average(subjects, averages))
+    if average >= PASSING_AVERAGE:
+        return f"✅ Your average is {average:.2f}, you pass without rattrapage."
+    requirements = rattrapage_requirements(subjects, averages)
+    if not requirements:
+        return f"❌ Your average is {average:.2f}; a single rattrapage cannot bring it to {PASSING_AVERAGE:.2f}."
+    lines = "\n".join(f"• {html.escape(record.name)}: {round_average(needed):.2f}" for record, needed in requirements)
+    return (f"Your average is {average:.2f}. Grade needed to pass if you retake only one subject:\n{lines}")
+
+async def need_grade(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    """حساب الدرجة المطلوبة: /need أثناء الحساب، أو /need math2 12 14 9 مباشرة"""
+    from inline_calculator import parse_query
+
+    if context.args:
+        parsed = parse_query(" ".join(context.args))
+        if parsed is None:
+            await update.message.reply_text("Usage: /need <level> <subject averages...>, e.g. /need math2 12 14 9")
+            return None
+        level, averages = parsed
+        subjects = get_subjects(LEVEL_SPECIALIZATIONS[level], level)
+    else:
+        session = context.user_data.get(SESSION_KEY)
+        if session is None or session.level is None:
+            await update.message.reply_text("Usage: /need <level> <subject averages...>, e.g. /need math2 12 14 9")
+            return None
+        subjects = get_subjects(session.specialization, session.level)
+        averages = list(session.averages)
+
+    if not subjects or len(averages) > len(subjects):
+        await update.message.reply_text(f"This level has {len(subjects)} subjects.")
+        return None
+    # None keeps the conversation in its current state
+    await update.message.reply_text(describe_requirements(subjects, averages), parse_mode='HTML')
+    return None
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """إلغاء العملية"""
+    context.user_data.pop(SESSION_KEY, None)
     await update.message.reply_text(
         "Operation cancelled. Type /start to begin again.",
         reply_markup=ReplyKeyboardRemove()
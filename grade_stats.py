@@ -0,0 +1,123 @@
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MAX_GRADE = 20.0
+BUCKET_WIDTH = 0.5
+BUCKET_COUNT = int(MAX_GRADE / BUCKET_WIDTH)
+# Key under which the statistics of a whole specialization are aggregated
+ALL_LEVELS = '*'
+
+StatsKey = Tuple[str, str]
+# (specialization, level, count, mean, m2, minimum, maximum, histogram)
+StatsRow = Tuple[str, str, int, float, float, float, float, bytes]
+
+
+class RunningStats:
+    """Streaming aggregate of overall averages, updated in O(1) per value.
+
+    Mean and variance use Welford's algorithm; quantiles and percentile ranks
+    are approximated from a histogram of 0.5-point buckets.
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.histogram = array('I', bytes(4 * BUCKET_COUNT))
+
+    @staticmethod
+    def _bucket(value: float) -> int:
+        return min(max(int(value / BUCKET_WIDTH), 0), BUCKET_COUNT - 1)
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.histogram[self._bucket(value)] += 1
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile (0 <= q <= 1), interpolated inside the bucket"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bucket, hits in enumerate(self.histogram):
+            if hits and seen + hits >= target:
+                value = (bucket + (target - seen) / hits) * BUCKET_WIDTH
+                return min(max(value, self.minimum), self.maximum)
+            seen += hits
+        return self.maximum
+
+    def percentile_rank(self, value: float) -> float:
+        """Approximate share (0..1) of recorded values below ``value``"""
+        if not self.count:
+            return 0.0
+        bucket = self._bucket(value)
+        below = sum(self.histogram[:bucket])
+        # Assume values are spread evenly inside the bucket holding ``value``
+        below += self.histogram[bucket] * (value / BUCKET_WIDTH - bucket)
+        return min(below / self.count, 1.0)
+
+    def to_row(self, key: StatsKey) -> StatsRow:
+        return (*key, self.count, self.mean, self.m2, self.minimum, self.maximum, self.histogram.tobytes())
+
+    @classmethod
+    def from_row(cls, row: StatsRow) -> Tuple[StatsKey, 'RunningStats']:
+        specialization, level, count, mean, m2, minimum, maximum, histogram = row
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = count, mean, m2
+        stats.minimum, stats.maximum = minimum, maximum
+        stats.histogram = array('I')
+        stats.histogram.frombytes(histogram)
+        return (specialization, level), stats
+
+
+class StatsEngine:
+    """Per-level and per-specialization grade distributions kept in memory.
+
+    Aggregates are seeded from the ``grade_stats`` table at startup; changed
+    ones are handed to the database in batches through ``dirty_rows``.
+    """
+
+    def __init__(self, rows: Iterable[StatsRow] = ()):
+        self._stats: Dict[StatsKey, RunningStats] = dict(RunningStats.from_row(row) for row in rows)
+        self._dirty: Set[StatsKey] = set()
+
+    def get(self, specialization: str, level: str = ALL_LEVELS) -> Optional[RunningStats]:
+        return self._stats.get((specialization, level))
+
+    def items(self) -> List[Tuple[StatsKey, RunningStats]]:
+        return sorted(self._stats.items())
+
+    def record(self, specialization: str, level: str, average: float):
+        for key in ((specialization, level), (specialization, ALL_LEVELS)):
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RunningStats()
+            stats.add(average)
+            self._dirty.add(key)
+
+    def dirty_rows(self) -> List[StatsRow]:
+        """Snapshot the aggregates changed since the last call"""
+        dirty, self._dirty = self._dirty, set()
+        return [self._stats[key].to_row(key) for key in dirty]
+
+    def mark_dirty(self, rows: Iterable[StatsRow]):
+        """Re-queue rows whose write failed"""
+        self._dirty.update((row[0], row[1]) for row in rows)
@@ -0,0 +1,97 @@
+import hashlib
+import html
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.ext import ContextTypes
+
+from calculator import overall_average, round_average
+from curriculum import LEVEL_SPECIALIZATIONS, get_subjects
+
+CACHE_SIZE = 2048
+# مدة تخزين النتائج في خوادم تيليجرام (بالثواني)
+TELEGRAM_CACHE_TIME = 300
+
+# "math4+5", "math4 +5", "math4(+5)" -> "math4 (+5)"
+_SUB_LEVEL = re.compile(r'^([a-z]+\d)\s*\(?\s*(\+[45])\s*\)?')
+_results_cache: "OrderedDict[str, List[InlineQueryResultArticle]]" = OrderedDict()
+
+
+def parse_query(query: str) -> Optional[Tuple[str, List[float]]]:
+    """تحليل الاستعلام إلى (المستوى، قائمة المعدلات)، أو None إذا كان غير صالح"""
+    text = query.strip().lower().replace(',', '.')
+    match = _SUB_LEVEL.match(text)
+    if match:
+        level, rest = f"{match.group(1)} ({match.group(2)})", text[match.end():]
+    else:
+        level, _, rest = text.partition(' ')
+    if level not in LEVEL_SPECIALIZATIONS:
+        return None
+    try:
+        grades = [float(value) for value in rest.split()]
+    except ValueError:
+        return None
+    if any(not 0 <= grade <= 20 for grade in grades):
+        return None
+    return level, grades
+
+
+def cache_key(level: str, grades: List[float]) -> str:
+    return f"{level} {' '.join(f'{grade:g}' for grade in grades)}"
+
+
+def _article(key: str, title: str, description: str, text: str) -> InlineQueryResultArticle:
+    return InlineQueryResultArticle(
+        id=hashlib.md5(key.encode()).hexdigest(),
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode='HTML'),
+    )
+
+
+def build_results(level: str, grades: List[float]) -> List[InlineQueryResultArticle]:
+    subjects = get_subjects(LEVEL_SPECIALIZATIONS[level], level)
+    key = cache_key(level, grades)
+    if not subjects:
+        return [_article(key, f"{level} is not available yet", "Please wait for upcoming updates.",
+                         f"{level} is not available yet.")]
+
+    if len(grades) != len(subjects):
+        listing = ", ".join(f"{html.escape(record.name)} ({record.coefficient})" for record in subjects)
+        return [_article(
+            key,
+            f"{level}: enter {len(subjects)} subject averages ({len(grades)} given)",
+            listing,
+            f"<b>{level}</b> subjects (coefficient), in order:\n{listing}",
+        )]
+
+    average = round_average(overall_average(subjects, grades))
+    verdict = "Congratulations!! YA LKHABACH" if average >= 10.00 else "Don't worry, Rana ga3 f rattrapage."
+    lines = "\n".join(f"{html.escape(record.name)}: {grade:g} × {record.coefficient}" for grade, record in zip(grades, subjects))
+    return [_article(
+        key,
+        f"{level} average: {average:.2f}",
+        verdict,
+        f"<b>{level}</b>\n{lines}\n\n<b>Overall average: {average:.2f}</b>\n{verdict}",
+    )]
+
+
+async def inline_average(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حساب المعدل مباشرة عبر الوضع المضمن: @bot math2 12 14 9 ..."""
+    parsed = parse_query(update.inline_query.query)
+    if parsed is None:
+        await update.inline_query.answer([], cache_time=TELEGRAM_CACHE_TIME)
+        return
+
+    level, grades = parsed
+    key = cache_key(level, grades)
+    results = _results_cache.get(key)
+    if results is None:
+        results = _results_cache[key] = build_results(level, grades)
+        if len(_results_cache) > CACHE_SIZE:
+            _results_cache.popitem(last=False)
+    else:
+        _results_cache.move_to_end(key)
+    await update.inline_query.answer(results, cache_time=TELEGRAM_CACHE_TIME)
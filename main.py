@@ -1,21 +1,35 @@
+import time
+
+# بداية قياس زمن الإقلاع (قبل استيراد المكتبات)
+BOOT_STARTED = time.monotonic()
+
 import logging
 import os
+import re
 import asyncio
+from typing import Optional
 from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
     ContextTypes,
     filters,
-    BasePersistence,
-    PicklePersistence,
 )
-from database import Database
+from telegram.request import BaseRequest, HTTPXRequest
+import metrics
+from logging_setup import configure_logging
+from database import AsyncDatabase, Database
+from persistence import SQLitePersistence
+from update_processor import PerChatUpdateProcessor
 from error_handler import notify_users, is_subscribed
+from inline_calculator import inline_average
 from grade_calculator import (
+    SAME_AS_LAST_TIME,
     start,
+    repeat_last_level,
     choose_specialization,
     choose_level,
     choose_sub_level,
@@ -24,26 +38,43 @@ from grade_calculator import (
     receive_tp_grade,
     receive_td_grade,
     receive_subject_average,
+    bulk_template,
+    receive_bulk_grades,
+    receive_bulk_file,
+    need_grade,
     cancel,
 )
 
-# 1. إعداد اللوجر
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# 1. إعداد اللوجر (مرة واحدة للعملية كلها، الكتابة تتم في خيط منفصل)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # 2. تعريف الثوابت
-SPECIALIZATION, LEVEL, SUB_LEVEL, FIRST, SECOND, TP, TD, NEXT_SUBJECT = range(8)
+SPECIALIZATION, LEVEL, SUB_LEVEL, FIRST, SECOND, TP, TD, NEXT_SUBJECT, BULK = range(9)
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "7202093679:AAE_xjF5I1RvlWRAee8rWv2fB73zyFfYmFs")
+DB_PATH = os.environ.get("DB_PATH", "bot_newdata.db")
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", 30))
+# عدد التحديثات التي تتم معالجتها في نفس الوقت (تحديثات نفس المحادثة تبقى بالترتيب)
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 64))
+ADMIN_ID = int(os.environ.get("ADMIN_ID", 5909420341))
+# 300 IDs of up to 10 digits stay below Telegram's 4096 character limit
+USER_IDS_PAGE_SIZE = 300
 WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "ens-average-bot-599688285140.europe-west1.run.app")
 WEBHOOK_URL = f"https://{WEBHOOK_HOST}/{BOT_TOKEN}"
+# الزمن المستهدف (بالثواني) من بدء العملية حتى الجاهزية لاستقبال التحديثات
+STARTUP_TARGET_SECONDS = float(os.environ.get("STARTUP_TARGET_SECONDS", 2.0))
+
+# أزمنة الإقلاع بالثواني منذ BOOT_STARTED، تُعرض في السجلات وعلى /metrics
+startup_timings = {}
+# مهام بدء التشغيل التي تعمل في الخلفية
+background_tasks = set()
 
 # 3. Custom Context & Database
 class CustomContext(ContextTypes.DEFAULT_TYPE):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.db = Database("bot_newdata.db")
+    @property
+    def db(self) -> AsyncDatabase:
+        """قاعدة البيانات المشتركة التي يتم إنشاؤها مرة واحدة عند بدء التشغيل"""
+        return self.application.bot_data["db"]
 
 context_types = ContextTypes(context=CustomContext)
 
@@ -52,16 +83,42 @@ async def help_command(update: Update, context: CustomContext):
     await update.message.reply_text("📚 <b>Here are the instructions:</b>\n\n1. Click <b>/start</b> to begin.\n2. Follow the prompts to enter your grades.\n3. Click <b>/cancel</b> to stop.", parse_mode='HTML')
 
 async def visitor_count(update: Update, context: CustomContext):
-    count = context.db.get_visitor_count()
+    count = await context.db.get_visitor_count()
     await update.message.reply_text(f"The bot has been visited by {count + 600} unique users.")
 
 async def overall_average_count(update: Update, context: CustomContext):
-    count = context.db.get_overall_average_count()
+    count = await context.db.get_overall_average_count()
     await update.message.reply_text(f"The Bot has been used {count + 1530} times.")
 
 async def show_user_ids(update: Update, context: CustomContext):
-    user_ids = context.db.get_all_user_ids()
-    await update.message.reply_text(f"Collected user IDs: {', '.join(map(str, user_ids))}")
+    """عرض معرفات المستخدمين صفحة بصفحة (للمشرف فقط)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    try:
+        after_user_id = int(context.args[0]) if context.args else 0
+    except ValueError:
+        await update.message.reply_text("Usage: /showUserIDs [after_user_id]")
+        return
+
+    user_ids = await context.db.get_user_id_page(after_user_id, USER_IDS_PAGE_SIZE)
+    if not user_ids:
+        await update.message.reply_text("No more user IDs.")
+        return
+    text = f"Collected user IDs: {', '.join(map(str, user_ids))}"
+    if len(user_ids) == USER_IDS_PAGE_SIZE:
+        text += f"\n\nNext page: /showUserIDs {user_ids[-1]}"
+    await update.message.reply_text(text)
+
+async def grade_stats(update: Update, context: CustomContext):
+    """لوحة إحصائيات المعدلات حسب التخصص والمستوى (للمشرف فقط)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    lines = [
+        f"{specialization}/{level}: n={stats.count} mean={stats.mean:.2f} sd={stats.stddev:.2f} "
+        f"median={stats.quantile(0.5):.2f} p90={stats.quantile(0.9):.2f}"
+        for (specialization, level), stats in context.db.stats.items()
+    ]
+    await update.message.reply_text("\n".join(lines) or "No calculations recorded yet.")
 
 async def whatsnew(update: Update, context: CustomContext):
     MESSAGE_whatsnew = "🎉 <b>New Patch Released!</b> 🎉\n\nHello everyone! We're excited to announce a new update..."
@@ -72,7 +129,6 @@ async def on_startup(application: Application):
     """
     دالة يتم تشغيلها عند بدء تشغيل الخادم لإرسال رسالة تأكيد.
     """
-    ADMIN_ID = 5909420341
     startup_message = "✅ Bot has started successfully on Cloud Run!"
     logger.info(f"Attempting to send startup message to admin {ADMIN_ID}")
     try:
@@ -82,41 +138,127 @@ async def on_startup(application: Application):
         logger.error("!!! An error occurred on startup sending message !!!", exc_info=True)
 
 
+async def resume_broadcasts(application: Application):
+    """استكمال أي بث توقف بسبب إعادة تشغيل الخادم"""
+    from broadcast import Broadcaster
+
+    await Broadcaster(application.bot, application.bot_data["db"]).resume()
+
+
+async def post_init(application: Application):
+    """تشغيل قاعدة البيانات المشتركة، والمهام غير العاجلة تعمل في الخلفية"""
+    application.bot_data["db"].start()
+    # لا ننتظر هذه المهام حتى لا تؤخر معالجة أول تحديث
+    for coroutine in (resume_broadcasts(application), on_startup(application)):
+        task = asyncio.create_task(coroutine)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+def mark_ready():
+    """تسجيل زمن الجاهزية ومقارنته بالهدف"""
+    elapsed = startup_timings["ready"] = time.monotonic() - BOOT_STARTED
+    if elapsed > STARTUP_TARGET_SECONDS:
+        logger.warning(f"Ready to serve updates after {elapsed:.2f}s (target {STARTUP_TARGET_SECONDS:.2f}s)")
+    else:
+        logger.info(f"Ready to serve updates after {elapsed:.2f}s")
+
+
+def mark_first_response():
+    """تسجيل الزمن حتى انتهاء معالجة أول تحديث بعد الإقلاع"""
+    elapsed = startup_timings["first_response"] = time.monotonic() - BOOT_STARTED
+    logger.info(f"First update handled {elapsed:.2f}s after start")
+
+
+async def post_shutdown(application: Application):
+    """إغلاق اتصالات قاعدة البيانات عند إيقاف التشغيل"""
+    # البث الموقوف يُستكمل من قاعدة البيانات عند التشغيل التالي
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    db = application.bot_data.pop("db", None)
+    if db is not None:
+        await db.close()
+
+
 # 4. بناء التطبيق
-application = (
-    Application.builder()
-    .token(BOT_TOKEN)
-    .context_types(context_types)
-    .build()
-)
+def build_application(db: AsyncDatabase, request: Optional[BaseRequest] = None) -> Application:
+    """بناء التطبيق مع جميع المعالجات.
 
-# 5. إضافة معالجات الأوامر والمحادثة
-conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("start", start)],
-    states={
-        SPECIALIZATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_specialization)],
-        LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_level)],
-        SUB_LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_sub_level)],
-        FIRST: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_first_grade)],
-        SECOND: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_second_grade)],
-        TP: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_tp_grade)],
-        TD: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_td_grade)],
-        NEXT_SUBJECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_subject_average)],
-    },
-    fallbacks=[CommandHandler("cancel", cancel)],
-    persistent=True,
-    name="grade_calculator_conv"
-)
-application.add_handler(conv_handler)
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("visitor_count", visitor_count))
-application.add_handler(CommandHandler("usage_count", overall_average_count))
-application.add_handler(CommandHandler("showUserIDs", show_user_ids))
-application.add_handler(CommandHandler("whats_new", whatsnew))
+    يمكن تمرير request بديل عن HTTPX (مثلاً في اختبارات الأداء دون شبكة).
+    """
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .context_types(context_types)
+        .persistence(SQLitePersistence(db, update_interval=PERSISTENCE_INTERVAL))
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES, on_first_update=mark_first_response))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is None and metrics.ENABLED:
+        # نفس حجم مجمع الاتصالات الافتراضي في PTB
+        request = HTTPXRequest(connection_pool_size=256)
+    if request is not None:
+        builder = builder.request(metrics.instrument_request(request))
+    application = builder.build()
+    application.bot_data["db"] = db
+
+    # 5. إضافة معالجات الأوامر والمحادثة
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("start", start)],
+        states={
+            SPECIALIZATION: [
+                MessageHandler(filters.Regex(f"^{re.escape(SAME_AS_LAST_TIME)}"), repeat_last_level),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, choose_specialization),
+            ],
+            LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_level)],
+            SUB_LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_sub_level)],
+            FIRST: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_first_grade),
+                CommandHandler("bulk", bulk_template),
+            ],
+            SECOND: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_second_grade),
+                CommandHandler("bulk", bulk_template),
+            ],
+            TP: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_tp_grade)],
+            TD: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_td_grade)],
+            NEXT_SUBJECT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_subject_average),
+                CommandHandler("bulk", bulk_template),
+            ],
+            BULK: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_bulk_grades),
+                MessageHandler(filters.Document.FileExtension("csv"), receive_bulk_file),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel), CommandHandler("need", need_grade)],
+        persistent=True,
+        name="grade_calculator_conv"
+    )
+    application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("visitor_count", visitor_count))
+    application.add_handler(CommandHandler("usage_count", overall_average_count))
+    application.add_handler(CommandHandler("showUserIDs", show_user_ids))
+    application.add_handler(CommandHandler("stats", grade_stats))
+    application.add_handler(CommandHandler("need", need_grade))
+    application.add_handler(InlineQueryHandler(inline_average))
+    application.add_handler(CommandHandler("whats_new", whatsnew))
+    # قياس زمن وأخطاء كل المعالجات عند تفعيل METRICS_ENABLED
+    metrics.instrument_handlers(handler for group in application.handlers.values() for handler in group)
+    return application
+
+
+# The database is created once here because the persistence loads saved
+# conversations from it during Application.initialize(), before post_init runs.
+database = AsyncDatabase(Database(DB_PATH))
+application = build_application(database)
 
-# The `application` object is what uvicorn will run.
-# No `if __name__ == "__main__"` needed.
-# The database and bot objects are now accessed via the context.
+# In production uvicorn serves `server:app`, which feeds webhook updates to
+# this `application`. Running this file directly uses PTB's built-in webhook
+# server instead, which is handy for local testing.
 
 if __name__ == "__main__":
     # --- التشغيل باستخدام Webhook ---
@@ -127,7 +269,6 @@ if __name__ == "__main__":
         port=port,
         url_path=BOT_TOKEN,
         webhook_url=WEBHOOK_URL,
-        on_startup=on_startup,
         allowed_updates=Update.ALL_TYPES,
     )
 
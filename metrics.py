@@ -0,0 +1,256 @@
+"""Lightweight in-process latency and error metrics in Prometheus text format.
+
+Instrumentation is switched on with METRICS_ENABLED=1. When it is off the
+helpers below return the original functions, locks and requests untouched,
+so the instrumented code runs exactly as before.
+"""
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from telegram.request import BaseRequest
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+
+# Upper bounds in seconds, from a cached SQLite read to a slow Bot API call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_metrics: List["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label: str):
+        super().__init__(name, help_text, label)
+        self._values: Dict[str, int] = {}
+
+    def inc(self, label_value: str, amount: int = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f'{self.name}{{{self.label}="{key}"}} {value}' for key, value in values]
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label)
+        self.buckets = tuple(buckets)
+        # label value -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, label_value: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label}="{key}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{key}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{key}"}} {cumulative}')
+        return lines
+
+
+HANDLER_SECONDS = Histogram("handler_duration_seconds", "Time spent in update handlers", "handler")
+HANDLER_ERRORS = Counter("handler_errors_total", "Update handlers that raised", "handler")
+DB_SECONDS = Histogram("db_query_duration_seconds", "Time spent in Database methods", "method")
+DB_ERRORS = Counter("db_errors_total", "Database methods that raised", "method")
+DB_LOCK_WAIT_SECONDS = Histogram("db_lock_wait_seconds", "Time spent waiting for the database write lock", "lock")
+BOT_API_SECONDS = Histogram("bot_api_duration_seconds", "Bot API request round trips", "method")
+BOT_API_ERRORS = Counter("bot_api_errors_total", "Bot API requests that failed", "method")
+
+
+def timed(histogram: Histogram, errors: Counter, label_value: str) -> Callable[[Callable], Callable]:
+    """Decorator recording the duration and failures of a sync or async function"""
+    def decorate(func: Callable) -> Callable:
+        if not ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    errors.inc(label_value)
+                    raise
+                finally:
+                    histogram.observe(label_value, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc(label_value)
+                raise
+            finally:
+                histogram.observe(label_value, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def instrument_methods(cls: type, histogram: Histogram = DB_SECONDS, errors: Counter = DB_ERRORS) -> type:
+    """Time every public method defined on ``cls``; usable as a class decorator"""
+    if ENABLED:
+        for name, member in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.isfunction(member):
+                setattr(cls, name, timed(histogram, errors, name)(member))
+    return cls
+
+
+def instrument_handlers(handlers: Iterable) -> None:
+    """Time the callbacks of the given handlers, including conversation steps"""
+    if not ENABLED:
+        return
+    from telegram.ext import ConversationHandler
+
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = _timed_callback(handler.callback)
+
+
+def _timed_callback(callback: Callable) -> Callable:
+    # Some callbacks are wrapped by sync decorators (e.g. retrying) that return
+    # the coroutine, so await whatever comes back
+    name = getattr(callback, "__name__", "callback")
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = callback(update, context)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(name, time.perf_counter() - started)
+    return wrapper
+
+
+class TimedLock:
+    """Wraps a threading lock to record how long callers wait to acquire it"""
+
+    def __init__(self, lock, name: str):
+        self._lock = lock
+        self.name = name
+
+    def acquire(self, *args, **kwargs) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        DB_LOCK_WAIT_SECONDS.observe(self.name, time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def timed_lock(lock, name: str):
+    return TimedLock(lock, name) if ENABLED else lock
+
+
+class InstrumentedRequest(BaseRequest):
+    """Delegates to another request object, timing every Bot API call"""
+
+    def __init__(self, request: BaseRequest):
+        self._request = request
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        await self._request.initialize()
+
+    async def shutdown(self) -> None:
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        api_method = "file_download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except Exception:
+            BOT_API_ERRORS.inc(api_method)
+            raise
+        finally:
+            BOT_API_SECONDS.observe(api_method, time.perf_counter() - started)
+        if code >= 400:
+            BOT_API_ERRORS.inc(api_method)
+        return code, payload
+
+
+def instrument_request(request: BaseRequest) -> BaseRequest:
+    return InstrumentedRequest(request) if ENABLED else request
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format (empty when disabled)"""
+    if not ENABLED:
+        return ""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
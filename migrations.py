@@ -0,0 +1,248 @@
+"""Versioned SQLite schema migrations, tracked with PRAGMA user_version.
+
+Migration N upgrades a database from version N-1 to N. Migrations only add to
+the schema (new tables, indexes, ``ALTER TABLE ... ADD COLUMN``) so they take
+the same time whatever the number of existing rows. Deployments apply them
+in a separate step rather than on every container start:
+
+    python migrations.py [db_path]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, List
+
+from logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    """Raised when a database cannot be brought up to date additively"""
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def table_columns(cursor: sqlite3.Cursor, table: str) -> Dict[str, str]:
+    """Column names and declared types of a table, empty if it does not exist"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1]: row[2] for row in cursor.fetchall()}
+
+
+def add_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+    """Add the columns a table is missing; ``columns`` maps name -> definition.
+
+    SQLite only allows constant defaults in ADD COLUMN, so timestamp columns
+    added this way start out NULL on existing rows.
+    """
+    existing = table_columns(cursor, table)
+    for name, definition in columns.items():
+        if name not in existing:
+            logger.info(f"Adding column {table}.{name}")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+def require_columns(cursor: sqlite3.Cursor, table: str, *names: str):
+    missing = [name for name in names if name not in table_columns(cursor, table)]
+    if missing:
+        raise MigrationError(f"Table {table} lacks key column(s) {', '.join(missing)} that cannot be added in place")
+
+
+def _baseline(cursor: sqlite3.Cursor):
+    """Schema as of the connection pool, persistence, broadcast jobs and grade stats"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visitors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            visit_count INTEGER DEFAULT 1,
+            last_visit TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS overall_average (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            count INTEGER DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_calculations INTEGER DEFAULT 0,
+            last_calculation TIMESTAMP,
+            average_grade REAL,
+            FOREIGN KEY (user_id) REFERENCES visitors(user_id)
+        )
+    ''')
+
+    # Databases created before versioning may hold older versions of the
+    # first three tables; complete them in place instead of copying rows
+    require_columns(cursor, 'visitors', 'user_id')
+    add_columns(cursor, 'visitors', {
+        'visit_count': 'INTEGER DEFAULT 1',
+        'last_visit': 'TIMESTAMP',
+        'created_at': 'TIMESTAMP',
+    })
+    require_columns(cursor, 'overall_average', 'id')
+    add_columns(cursor, 'overall_average', {
+        'count': 'INTEGER DEFAULT 0',
+        'last_updated': 'TIMESTAMP',
+    })
+    require_columns(cursor, 'user_stats', 'user_id')
+    add_columns(cursor, 'user_stats', {
+        'total_calculations': 'INTEGER DEFAULT 0',
+        'last_calculation': 'TIMESTAMP',
+        'average_grade': 'REAL',
+    })
+
+    # Conversation state and user_data persisted by SQLitePersistence
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, key)
+        )
+    ''')
+
+    # Durable broadcast jobs and their per-user delivery status
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            parse_mode TEXT,
+            cursor INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            sent INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Streaming grade distributions maintained by grade_stats.StatsEngine
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_stats (
+            specialization TEXT NOT NULL,
+            level TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            minimum REAL,
+            maximum REAL,
+            histogram BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (specialization, level)
+        )
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_user_id ON visitors(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_last_visit ON visitors(last_visit)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_last_calculation ON user_stats(last_calculation)')
+
+
+def _user_profiles(cursor: sqlite3.Cursor):
+    """Last specialization and level chosen by each user"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            specialization TEXT NOT NULL,
+            level TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _broadcast_leases(cursor: sqlite3.Cursor):
+    """Lease on running broadcast jobs so only one process sends each job"""
+    # Jobs left running by older versions have no lease and can be resumed
+    add_columns(cursor, 'broadcast_jobs', {
+        'lease_owner': 'TEXT',
+        'lease_expires_at': 'REAL',
+    })
+
+
+# Append new migrations at the end; never edit or reorder applied ones.
+# Version 1 matches databases stamped by the previous in-process schema check.
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _baseline,
+    _user_profiles,
+    _broadcast_leases,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn: sqlite3.Connection, target: int = SCHEMA_VERSION) -> List[int]:
+    """Apply pending migrations up to ``target``, each in its own transaction.
+
+    The version is read again once the write lock is held, so a migration
+    another process applied in the meantime is skipped rather than re-run.
+    Returns the versions that were applied.
+    """
+    applied = []
+    version = get_version(conn)
+    if version > SCHEMA_VERSION:
+        logger.warning(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+    for version in range(version + 1, target + 1):
+        migration = MIGRATIONS[version - 1]
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            logger.info(f"Applying migration {version}: {migration.__doc__}")
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations to the bot database")
+    parser.add_argument('db_path', nargs='?', default=os.environ.get('DB_PATH', 'bot_newdata.db'))
+    parser.add_argument('--check', action='store_true',
+                        help="only report whether migrations are pending (exit code 1 if so)")
+    args = parser.parse_args()
+    configure_logging()
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        conn.execute('PRAGMA busy_timeout=5000')
+        version = get_version(conn)
+        if args.check:
+            logger.info(f"{args.db_path}: schema version {version}, code expects {SCHEMA_VERSION}")
+            raise SystemExit(1 if version < SCHEMA_VERSION else 0)
+        applied = migrate(conn)
+        logger.info(f"{args.db_path}: applied {len(applied)} migration(s), now at version {get_version(conn)}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import pickle
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores conversation states and user_data in the bot's SQLite database.
+
+    The application hands over only the entries that changed since its last
+    persistence run (every ``update_interval`` seconds). They are staged in
+    memory and written together in a single transaction, so the cost of a
+    flush grows with the number of active users, not the total user base.
+    bot_data, chat_data and callback data are not persisted.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = 30):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self._dirty_user_data: Dict[int, Optional[bytes]] = {}
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _schedule_flush(self):
+        # All changes of one persistence run are handed over concurrently;
+        # yielding once lets them be collected into a single write.
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty_user_data and not self._dirty_conversations:
+            return
+        user_data, self._dirty_user_data = self._dirty_user_data, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        try:
+            await self.db.save_persisted_state(user_data, conversations)
+        except Exception:
+            logger.error("Failed to persist conversation state, retrying on next flush", exc_info=True)
+            # Newer changes staged in the meantime take precedence
+            self._dirty_user_data = {**user_data, **self._dirty_user_data}
+            self._dirty_conversations = {**conversations, **self._dirty_conversations}
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        rows = await self.db.load_persisted_user_data()
+        return {user_id: pickle.loads(data) for user_id, data in rows.items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        rows = await self.db.load_persisted_conversations(name)
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        self._dirty_conversations[(name, json.dumps(key))] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._dirty_user_data[user_id] = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL) if data else None
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty_user_data[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Write everything still staged; called by the application on shutdown"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_dirty()
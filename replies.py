@@ -0,0 +1,57 @@
+"""Compose a handler's answer and send it in as few Bot API calls as possible"""
+import html
+from typing import List, Optional, Union
+
+from telegram import ForceReply, InlineKeyboardMarkup, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.constants import MessageLimit, ParseMode
+
+ReplyMarkup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply]
+
+
+class Reply:
+    """Collects the parts of one answer and sends them as a single message.
+
+    Parts are HTML and are separated by a blank line. The answer only spans
+    several messages when it would exceed Telegram's length limit; the
+    keyboard is attached to the last one.
+    """
+
+    def __init__(self, separator: str = "\n\n"):
+        self.separator = separator
+        self.parts: List[str] = []
+        self.reply_markup: Optional[ReplyMarkup] = None
+
+    def add(self, text: str) -> "Reply":
+        """Append an HTML part"""
+        self.parts.append(text)
+        return self
+
+    def add_text(self, text: str) -> "Reply":
+        """Append a plain text part, escaped for HTML"""
+        return self.add(html.escape(text, quote=False))
+
+    def markup(self, reply_markup: ReplyMarkup) -> "Reply":
+        self.reply_markup = reply_markup
+        return self
+
+    def messages(self) -> List[str]:
+        """Join the parts into as few messages as fit the length limit"""
+        messages: List[str] = []
+        for part in self.parts:
+            if messages and len(messages[-1]) + len(self.separator) + len(part) <= MessageLimit.MAX_TEXT_LENGTH:
+                messages[-1] += self.separator + part
+            else:
+                messages.append(part)
+        return messages
+
+    async def send(self, message: Message) -> Optional[Message]:
+        """Reply to ``message``, returning the last message sent"""
+        texts = self.messages()
+        sent = None
+        for number, text in enumerate(texts, start=1):
+            sent = await message.reply_text(
+                text,
+                parse_mode=ParseMode.HTML,
+                reply_markup=self.reply_markup if number == len(texts) else None,
+            )
+        return sent
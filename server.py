@@ -0,0 +1,104 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+import metrics
+from main import BOT_TOKEN, WEBHOOK_URL, application, mark_ready, startup_timings
+
+logger = logging.getLogger(__name__)
+
+# يتحقق تيليجرام من هذا الرمز في ترويسة كل طلب webhook إذا تم ضبطه
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+# عدادات بسيطة تُعرض على /metrics
+_counters = {
+    "webhook_updates_received_total": 0,
+    "webhook_updates_rejected_total": 0,
+}
+_started_at = time.time()
+
+
+async def telegram_webhook(request: Request) -> Response:
+    """استقبال التحديث ووضعه في طابور التطبيق دون انتظار معالجته"""
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        _counters["webhook_updates_rejected_total"] += 1
+        return Response(status_code=403)
+    try:
+        update = Update.de_json(await request.json(), application.bot)
+    except Exception as e:
+        logger.warning(f"Received an invalid webhook payload: {e}")
+        _counters["webhook_updates_rejected_total"] += 1
+        return Response(status_code=400)
+
+    _counters["webhook_updates_received_total"] += 1
+    application.update_queue.put_nowait(update)
+    return Response(status_code=200)
+
+
+async def healthz(request: Request) -> Response:
+    """فحص الحياة لـ Cloud Run، لا يلمس منطق البوت"""
+    return PlainTextResponse("ok")
+
+
+def render_metrics() -> str:
+    lines = [
+        "# TYPE webhook_updates_received_total counter",
+        f"webhook_updates_received_total {_counters['webhook_updates_received_total']}",
+        "# TYPE webhook_updates_rejected_total counter",
+        f"webhook_updates_rejected_total {_counters['webhook_updates_rejected_total']}",
+        "# TYPE update_queue_size gauge",
+        f"update_queue_size {application.update_queue.qsize()}",
+        "# TYPE update_processor_active_chats gauge",
+        f"update_processor_active_chats {application.update_processor.active_chats}",
+        "# TYPE application_running gauge",
+        f"application_running {int(application.running)}",
+        "# TYPE process_start_time_seconds gauge",
+        f"process_start_time_seconds {_started_at}",
+    ]
+    for name, seconds in startup_timings.items():
+        lines += [f"# TYPE startup_{name}_seconds gauge", f"startup_{name}_seconds {seconds:.3f}"]
+    return "\n".join(lines) + "\n" + metrics.render()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    # Telegram keeps the webhook between restarts, so registering it again
+    # does not need to delay serving the first update
+    application.create_task(application.bot.set_webhook(
+        url=WEBHOOK_URL,
+        allowed_updates=Update.ALL_TYPES,
+        secret_token=WEBHOOK_SECRET,
+    ))
+    mark_ready()
+    try:
+        yield
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+app = Starlette(
+    routes=[
+        Route(f"/{BOT_TOKEN}", telegram_webhook, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
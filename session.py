@@ -0,0 +1,88 @@
+from array import array
+from typing import Optional, Tuple
+
+SESSION_KEY = 'session'
+
+
+class GradeSession:
+    """Compact state of one student's running calculation.
+
+    Lives in ``context.user_data[SESSION_KEY]`` instead of loose dict keys and
+    pickles to a flat tuple of primitives, so it is cheap to keep in memory and
+    to persist.
+    """
+
+    __slots__ = (
+        'specialization',
+        'level',
+        'level_base',
+        'index',
+        'total_grades',
+        'total_coefficients',
+        'first_grade',
+        'averages',
+    )
+
+    def __init__(self, specialization: str):
+        self.specialization = specialization
+        self.level: Optional[str] = None
+        self.level_base: Optional[str] = None
+        self.first_grade: Optional[float] = None
+        self.reset()
+
+    def reset(self):
+        """Forget all grades entered so far"""
+        self.index = 0
+        self.total_grades = 0.0
+        self.total_coefficients = 0.0
+        self.first_grade = None
+        self.averages = array('d')
+
+    def begin(self, level: str):
+        """Start a fresh calculation for ``level``"""
+        self.level = level
+        self.reset()
+
+    def add_subject(self, average: float, coefficient: float):
+        """Record the average of the current subject and move to the next one"""
+        self.total_grades += average * coefficient
+        self.total_coefficients += coefficient
+        self.averages.append(average)
+        self.first_grade = None
+        self.index += 1
+
+    @property
+    def average(self) -> float:
+        return self.total_grades / self.total_coefficients
+
+    def dump(self) -> Tuple:
+        return (
+            self.specialization,
+            self.level,
+            self.level_base,
+            self.index,
+            self.total_grades,
+            self.total_coefficients,
+            self.first_grade,
+            self.averages.tobytes(),
+        )
+
+    @classmethod
+    def load(cls, state: Tuple) -> 'GradeSession':
+        session = cls.__new__(cls)
+        (
+            session.specialization,
+            session.level,
+            session.level_base,
+            session.index,
+            session.total_grades,
+            session.total_coefficients,
+            session.first_grade,
+            averages,
+        ) = state
+        session.averages = array('d')
+        session.averages.frombytes(averages)
+        return session
+
+    def __reduce__(self):
+        return (GradeSession.load, (self.dump(),))
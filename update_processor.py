@@ -0,0 +1,86 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each chat's updates in order.
+
+    Up to ``max_concurrent_updates`` updates run at the same time, but two
+    updates of the same chat never overlap: the second one waits for the
+    first, so grades are applied to the conversation state in the order they
+    were sent. asyncio locks wake waiters first in, first out, and the
+    application starts update tasks in arrival order.
+
+    Updates without a chat or user (e.g. polls) are not serialized.
+
+    ``on_first_update`` is called once, after the first update was processed.
+    """
+
+    __slots__ = ('_locks', '_waiters', '_on_first_update')
+
+    def __init__(self, max_concurrent_updates: int, on_first_update: Optional[Callable[[], None]] = None):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+        self._on_first_update = on_first_update
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            # Inline queries carry no chat; they are ordered per user instead
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Wait for the chat's turn first, then for a global slot.
+
+        Overrides the base implementation, which takes the global slot before
+        calling do_process_update: updates queued behind their own chat would
+        then hold slots while doing nothing and stall every other chat.
+        """
+        key = self._key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock, self._semaphore:
+                await self.do_process_update(update, coroutine)
+        finally:
+            # Drop the lock once nobody of this chat is waiting, so the dict
+            # only holds chats that currently have updates in flight
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        try:
+            await coroutine
+        finally:
+            if self._on_first_update is not None:
+                callback, self._on_first_update = self._on_first_update, None
+                callback()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def active_chats(self) -> int:
+        """Chats with at least one update being processed or waiting"""
+        return len(self._locks)
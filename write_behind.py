@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Signature of the coroutine that persists one coalesced batch:
+# (visits per user_id, number of finished calculations)
+FlushCallback = Callable[[Dict[int, int], int], Awaitable[None]]
+
+
+class WriteBehindBuffer:
+    """Coalesces visitor and usage counter updates in memory.
+
+    Pending updates are written in a single transaction every ``interval``
+    seconds, or as soon as ``max_events`` updates have accumulated, whichever
+    comes first. ``close()`` always flushes what is left.
+    """
+
+    def __init__(self, flush_callback: FlushCallback, interval: float = 2.0, max_events: int = 500):
+        self._flush_callback = flush_callback
+        self.interval = interval
+        self.max_events = max_events
+        self._visits: Dict[int, int] = defaultdict(int)
+        self._usage = 0
+        self._events = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def pending_usage(self) -> int:
+        """Finished calculations not yet written to the database"""
+        return self._usage
+
+    def add_visit(self, user_id: int):
+        self._visits[user_id] += 1
+        self._record_event()
+
+    def add_usage(self, count: int = 1):
+        self._usage += count
+        self._record_event()
+
+    def _record_event(self):
+        self._events += 1
+        if self._events >= self.max_events:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background flush loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="write-behind-flush")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending updates in one batch"""
+        async with self._flush_lock:
+            if not self._events:
+                return
+            visits, usage = dict(self._visits), self._usage
+            self._visits.clear()
+            self._usage = 0
+            self._events = 0
+            try:
+                await self._flush_callback(visits, usage)
+            except Exception:
+                logger.error("Failed to flush counter batch, keeping it for the next attempt", exc_info=True)
+                self._requeue(visits, usage)
+            except BaseException:
+                # Cancelled mid-write: the batch is no longer in the buffer,
+                # so put it back for close() or the next flush
+                self._requeue(visits, usage)
+                raise
+
+    def _requeue(self, visits: Dict[int, int], usage: int):
+        for user_id, count in visits.items():
+            self._visits[user_id] += count
+        self._usage += usage
+        self._events += len(visits) + usage
+
+    async def close(self):
+        """Stop the flush loop and write whatever is still pending.
+
+        The loop is asked to stop rather than cancelled, so a flush already
+        in progress completes instead of being abandoned mid-write.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()